@@ -4,6 +4,7 @@
 import logging
 import os
 import sys
+from functools import lru_cache
 
 import click
 
@@ -86,6 +87,30 @@ def kci_err(content):
     click.secho(content, fg="red", err=True)
 
 
+@lru_cache(maxsize=None)
+def kci_use_color():
+    # https://no-color.org/
+    if os.environ.get("NO_COLOR"):
+        return False
+    return sys.stdout.isatty()
+
+
+def kci_style(content, fg):
+    """Return content colored with fg, or as is if colors are disabled"""
+    if not kci_use_color():
+        return content
+    return click.style(content, fg=fg)
+
+
+def kci_msg_buffered(content):
+    """Like kci_msg, but without flushing stdout, see kci_flush"""
+    sys.stdout.write(content + "\n")
+
+
+def kci_flush():
+    sys.stdout.flush()
+
+
 def kci_msg_nonl(content):
     click.echo(content, nl=False)
 
@@ -104,3 +129,13 @@ def kci_msg_yellow_nonl(content):
 
 def kci_msg_cyan_nonl(content):
     click.secho(content, fg="cyan", nl=False)
+
+
+def kci_cache_dir(*subdirs):
+    """Return (and create) a kci-dev cache directory, honouring XDG_CACHE_HOME"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    path = os.path.join(base, "kci-dev", *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
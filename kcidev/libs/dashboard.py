@@ -1,69 +1,345 @@
+import codecs
+import gzip
+import hashlib
 import json
+import os
+import re
+import tempfile
+import threading
+import time
 import urllib
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from kcidev.libs.common import *
 
 DASHBOARD_API = "https://dashboard.kernelci.org/api/"
 
+# Defaults for the shared dashboard session, can be overridden per instance
+# with dashboard_pool_size, dashboard_connect_timeout and
+# dashboard_read_timeout in the settings file
+DASHBOARD_POOL_SIZE = 10
+DASHBOARD_CONNECT_TIMEOUT = 10
+DASHBOARD_READ_TIMEOUT = 120
+
+_session = None
+_session_lock = threading.Lock()
+_session_options = {
+    "pool_size": DASHBOARD_POOL_SIZE,
+    "connect_timeout": DASHBOARD_CONNECT_TIMEOUT,
+    "read_timeout": DASHBOARD_READ_TIMEOUT,
+}
+
+
+def dashboard_set_session_options(cfg, instance):
+    """
+    Load dashboard session options from the instance section of the
+    settings file, dropping any session created with the previous ones
+    """
+    global _session
+    section = {}
+    if cfg and instance and isinstance(cfg.get(instance), dict):
+        section = cfg[instance]
+    for option in _session_options:
+        key = f"dashboard_{option}"
+        if key in section:
+            _session_options[option] = section[key]
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def dashboard_session():
+    """
+    Return the shared dashboard session, so consecutive requests reuse
+    pooled keep-alive connections instead of doing a new TLS handshake
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(
+                pool_connections=_session_options["pool_size"],
+                pool_maxsize=_session_options["pool_size"],
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def dashboard_timeout():
+    return (_session_options["connect_timeout"], _session_options["read_timeout"])
+
+
+# Time to live (in seconds) of cached dashboard responses. Results of recent
+# checkouts are still coming in, the ones older than DASHBOARD_CACHE_SETTLE_TIME
+# rarely change. Expired entries are revalidated with their ETag before being
+# refetched.
+DASHBOARD_CACHE_TTL_LATEST = 5 * 60
+DASHBOARD_CACHE_TTL_OLD = 7 * 24 * 60 * 60
+DASHBOARD_CACHE_TTL_TREES = 60
+DASHBOARD_CACHE_SETTLE_TIME = 2 * 24 * 60 * 60
+
+_cache_enabled = True
+
+
+def dashboard_set_cache(enabled):
+    global _cache_enabled
+    _cache_enabled = enabled
+
+
+def dashboard_cache_enabled():
+    return _cache_enabled
+
+
+def _cache_paths(url):
+    key = hashlib.sha256(url.encode()).hexdigest()
+    cache_dir = kci_cache_dir("dashboard")
+    return (
+        os.path.join(cache_dir, key + ".json.gz"),
+        os.path.join(cache_dir, key + ".meta"),
+    )
+
+
+def _cache_write(path, content):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def dashboard_cache_load(url):
+    """Return the cache metadata for url, or None if nothing is cached"""
+    payload_path, meta_path = _cache_paths(url)
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(payload_path):
+        return None
+    meta["payload"] = payload_path
+    return meta
+
+
+def dashboard_cache_fresh(meta):
+    return time.time() - meta["fetched"] < meta["ttl"]
+
+
+def dashboard_cache_data(meta):
+    """Return the cached payload, or None if the entry can't be read back"""
+    try:
+        with gzip.open(meta["payload"], "rb") as f:
+            return json.load(f)
+    except (OSError, EOFError, ValueError) as e:
+        kci_info(f"Ignoring broken cache entry {meta['payload']}: {e}")
+        return None
+
+
+def dashboard_cache_store(url, content, etag, ttl):
+    payload_path, meta_path = _cache_paths(url)
+    meta = {"url": url, "etag": etag, "fetched": time.time(), "ttl": ttl}
+    try:
+        _cache_write(payload_path, gzip.compress(content))
+        _cache_write(meta_path, json.dumps(meta).encode())
+    except OSError as e:
+        kci_info(f"Failed to cache {url}: {e}")
+
+
+def dashboard_cache_touch(url, meta, ttl):
+    _, meta_path = _cache_paths(url)
+    meta = {"url": url, "etag": meta["etag"], "fetched": time.time(), "ttl": ttl}
+    try:
+        _cache_write(meta_path, json.dumps(meta).encode())
+    except OSError as e:
+        kci_info(f"Failed to cache {url}: {e}")
+
+
+def _dashboard_url(endpoint, params):
+    base_url = urllib.parse.urljoin(DASHBOARD_API, endpoint)
+    return "{}?{}".format(base_url, urllib.parse.urlencode(params))
+
+
+# Status codes that should trigger a retry
+DASHBOARD_RETRY_STATUS_CODES = [429, 500, 502, 503, 504, 507]
+
+
+def _cache_ttl(ttl, data):
+    """Return the ttl to cache data with, ttl can be a function of data"""
+    return ttl(data) if callable(ttl) else ttl
+
 
 def _dashboard_request(func):
     @wraps(func)
-    def wrapper(endpoint, params, use_json, body=None, max_retries=3):
-        base_url = urllib.parse.urljoin(DASHBOARD_API, endpoint)
-        url = "{}?{}".format(base_url, urllib.parse.urlencode(params))
+    def wrapper(
+        endpoint, params, use_json, body=None, max_retries=3, ttl=None, quiet=False
+    ):
+        url = _dashboard_url(endpoint, params)
+        report = kci_info if quiet else kci_err
         retries = 0
 
-        # Status codes that should trigger a retry
-        RETRY_STATUS_CODES = [429, 500, 502, 503, 504, 507]
+        # Only GET requests given a ttl are cached
+        cached = None
+        headers = {}
+        if ttl and body is None and dashboard_cache_enabled():
+            cached = dashboard_cache_load(url)
+        if cached and dashboard_cache_fresh(cached):
+            data = dashboard_cache_data(cached)
+            if data is not None:
+                kci_info(f"dashboard cache hit: {url}")
+                return data
+            cached = None
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
 
         while retries <= max_retries:
             try:
-                r = func(url, params, use_json, body)
-                if r.status_code in RETRY_STATUS_CODES:
+                r = func(url, params, use_json, body, headers)
+                if r.status_code == 304 and cached:
+                    data = dashboard_cache_data(cached)
+                    if data is not None:
+                        kci_info(f"dashboard cache revalidated: {url}")
+                        dashboard_cache_touch(url, cached, _cache_ttl(ttl, data))
+                        return data
+                    # Cached copy is gone, fetch it again unconditionally
+                    headers = {}
+                    cached = None
+                    continue
+                if r.status_code in DASHBOARD_RETRY_STATUS_CODES:
                     retries += 1
                     if retries <= max_retries:
                         continue
                     else:
-                        kci_err(f"Failed after {max_retries} retries with 500 error.")
+                        report(f"Failed after {max_retries} retries with 500 error.")
                         raise click.Abort()
 
                 r.raise_for_status()
 
                 data = r.json()
                 if "error" in data:
-                    if use_json:
+                    if quiet:
+                        kci_info("json error: " + str(data["error"]))
+                    elif use_json:
                         kci_msg(data)
                     else:
                         kci_msg("json error: " + str(data["error"]))
                     raise click.Abort()
+                if ttl and body is None and dashboard_cache_enabled():
+                    etag = r.headers.get("ETag")
+                    dashboard_cache_store(url, r.content, etag, _cache_ttl(ttl, data))
                 return data
 
             except requests.exceptions.RequestException as e:
-                kci_err(f"Failed to fetch from {DASHBOARD_API}: {str(e)}.")
+                report(f"Failed to fetch from {DASHBOARD_API}: {str(e)}.")
                 raise click.Abort()
 
-        kci_err("Unexpected failure in API request")
+        report("Unexpected failure in API request")
         raise click.Abort()
 
     return wrapper
 
 
 @_dashboard_request
-def dashboard_api_post(endpoint, params, use_json, body, max_retries=3):
-    return requests.post(endpoint, json=body)
+def dashboard_api_post(endpoint, params, use_json, body, headers):
+    return dashboard_session().post(
+        endpoint, json=body, headers=headers, timeout=dashboard_timeout()
+    )
 
 
 @_dashboard_request
-def dashboard_api_fetch(endpoint, params, use_json, max_retries=3):
-    return requests.get(endpoint)
+def dashboard_api_fetch(endpoint, params, use_json, body, headers):
+    return dashboard_session().get(
+        endpoint, headers=headers, timeout=dashboard_timeout()
+    )
+
+
+def _checkout_age(start_time):
+    """Return the age in seconds of a checkout start_time, or None"""
+    try:
+        started = datetime.fromisoformat(start_time.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if started.tzinfo is None:
+        started = started.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - started).total_seconds()
+
+
+def dashboard_tree_head(origin, giturl, branch, commit):
+    """
+    Check whether commit is the newest checkout of its tree, or might be
+    as the tree list can't be fetched
+    """
+    try:
+        trees = dashboard_fetch_tree_list(origin, False, quiet=True)
+    except click.exceptions.Abort:
+        return True
+    return any(
+        t["git_repository_url"] == giturl
+        and t["git_repository_branch"] == branch
+        and t["git_commit_hash"] == commit
+        for t in trees
+    )
+
+
+def dashboard_commit_ttl(origin, giturl, branch, commit):
+    """
+    Return the cache ttl of a results response of commit, as a function of
+    the response, so it is only worked out when the response is stored.
+    Results are kept for long once the newest of them started more than
+    DASHBOARD_CACHE_SETTLE_TIME ago, responses without start times
+    (summaries) unless commit is the newest checkout of its tree.
+    Responses without any result yet are never kept for long.
+    """
+
+    def ttl(data):
+        if dashboard_results_empty(data):
+            return DASHBOARD_CACHE_TTL_LATEST
+        ages = [
+            _checkout_age(record.get("start_time"))
+            for kind in ["builds", "boots", "tests"]
+            for record in data.get(kind) or []
+        ]
+        ages = [age for age in ages if age is not None]
+        if ages:
+            if min(ages) >= DASHBOARD_CACHE_SETTLE_TIME:
+                return DASHBOARD_CACHE_TTL_OLD
+            return DASHBOARD_CACHE_TTL_LATEST
+        if dashboard_tree_head(origin, giturl, branch, commit):
+            return DASHBOARD_CACHE_TTL_LATEST
+        return DASHBOARD_CACHE_TTL_OLD
+
+    return ttl
+
+
+def dashboard_results_empty(data):
+    """
+    Check whether a commit results response holds no result at all, which
+    is what the dashboard returns before the first results come in
+    """
+    if not isinstance(data, dict):
+        return False
+    for kind in ["builds", "boots", "tests"]:
+        if isinstance(data.get(kind), list):
+            return not data[kind]
+    summary = data.get("summary")
+    if isinstance(summary, dict):
+        return not any(
+            count
+            for kind in ["builds", "boots", "tests"]
+            for count in summary.get(kind, {}).get("status", {}).values()
+        )
+    return False
 
 
 def dashboard_fetch_summary(origin, giturl, branch, commit, arch, use_json):
     endpoint = f"tree/{commit}/summary"
+    ttl = dashboard_commit_ttl(origin, giturl, branch, commit)
     params = {
         "origin": origin,
         "git_url": giturl,
@@ -71,11 +347,12 @@ def dashboard_fetch_summary(origin, giturl, branch, commit, arch, use_json):
     }
     if arch is not None:
         params["filter_architecture"] = arch
-    return dashboard_api_fetch(endpoint, params, use_json)
+    return dashboard_api_fetch(endpoint, params, use_json, ttl=ttl)
 
 
 def dashboard_fetch_builds(origin, giturl, branch, commit, arch, use_json):
     endpoint = f"tree/{commit}/builds"
+    ttl = dashboard_commit_ttl(origin, giturl, branch, commit)
     params = {
         "origin": origin,
         "git_url": giturl,
@@ -83,11 +360,12 @@ def dashboard_fetch_builds(origin, giturl, branch, commit, arch, use_json):
     }
     if arch is not None:
         params["filter_architecture"] = arch
-    return dashboard_api_fetch(endpoint, params, use_json)
+    return dashboard_api_fetch(endpoint, params, use_json, ttl=ttl)
 
 
 def dashboard_fetch_boots(origin, giturl, branch, commit, arch, use_json):
     endpoint = f"tree/{commit}/boots"
+    ttl = dashboard_commit_ttl(origin, giturl, branch, commit)
     params = {
         "origin": origin,
         "git_url": giturl,
@@ -95,11 +373,12 @@ def dashboard_fetch_boots(origin, giturl, branch, commit, arch, use_json):
     }
     if arch is not None:
         params["filter_architecture"] = arch
-    return dashboard_api_fetch(endpoint, params, use_json)
+    return dashboard_api_fetch(endpoint, params, use_json, ttl=ttl)
 
 
 def dashboard_fetch_tests(origin, giturl, branch, commit, arch, use_json):
     endpoint = f"tree/{commit}/tests"
+    ttl = dashboard_commit_ttl(origin, giturl, branch, commit)
     params = {
         "origin": origin,
         "git_url": giturl,
@@ -107,24 +386,249 @@ def dashboard_fetch_tests(origin, giturl, branch, commit, arch, use_json):
     }
     if arch is not None:
         params["filter_architecture"] = arch
-    return dashboard_api_fetch(endpoint, params, use_json)
+    return dashboard_api_fetch(endpoint, params, use_json, ttl=ttl)
+
+
+def dashboard_fetch_commit_results(
+    origin, giturl, branch, commit, arch, use_json, kinds
+):
+    """
+    Fetch several of the summary, builds, boots and tests results of a commit
+    in parallel, returning them in a dict indexed by kind
+    """
+    fetchers = {
+        "summary": dashboard_fetch_summary,
+        "builds": dashboard_fetch_builds,
+        "boots": dashboard_fetch_boots,
+        "tests": dashboard_fetch_tests,
+    }
+    with ThreadPoolExecutor(max_workers=len(kinds)) as executor:
+        futures = {
+            kind: executor.submit(
+                fetchers[kind], origin, giturl, branch, commit, arch, use_json
+            )
+            for kind in kinds
+        }
+        return {kind: future.result() for kind, future in futures.items()}
+
+
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+JSON_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _iter_json_array(chunks, key, use_json, quiet=False):
+    """
+    Incrementally decode the items of the array stored under key in the
+    top level JSON object read from chunks of bytes, without buffering more
+    than one item (plus a chunk) at a time
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    state = {"buf": "", "pos": 0, "eof": False}
+
+    def read_more():
+        if state["eof"]:
+            raise ValueError("Truncated JSON response")
+        chunk = next(chunks, None)
+        if chunk is None:
+            state["eof"] = True
+            state["buf"] += utf8.decode(b"", final=True)
+            return
+        state["buf"] = state["buf"][state["pos"] :] + utf8.decode(chunk)
+        state["pos"] = 0
+
+    def peek():
+        while True:
+            state["pos"] = JSON_WHITESPACE.match(state["buf"], state["pos"]).end()
+            if state["pos"] < len(state["buf"]):
+                return state["buf"][state["pos"]]
+            read_more()
+
+    def expect(char):
+        if peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {state['pos']}")
+        state["pos"] += 1
+
+    def value():
+        peek()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(state["buf"], state["pos"])
+                # A number running up to the end of the buffer might be cut short
+                if isinstance(obj, (int, float)):
+                    end_number = JSON_NUMBER_TAIL.match(state["buf"], end).end()
+                else:
+                    end_number = end
+                if end_number < len(state["buf"]) or state["eof"]:
+                    state["pos"] = end
+                    return obj
+            except json.JSONDecodeError:
+                if state["eof"]:
+                    raise
+            read_more()
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        name = value()
+        expect(":")
+        if name == key and peek() == "[":
+            state["pos"] += 1
+            if peek() == "]":
+                state["pos"] += 1
+            else:
+                while True:
+                    yield value()
+                    if peek() == "]":
+                        state["pos"] += 1
+                        break
+                    expect(",")
+        else:
+            data = value()
+            if name == "error":
+                if quiet:
+                    kci_info("json error: " + str(data))
+                elif use_json:
+                    kci_msg({"error": data})
+                else:
+                    kci_msg("json error: " + str(data))
+                raise click.Abort()
+        if peek() == "}":
+            return
+        expect(",")
+
+
+def _iter_cached_chunks(meta):
+    with gzip.open(meta["payload"], "rb") as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _iter_response_chunks(url, r, cache):
+    """Yield the response body, copying it to the cache once fully read"""
+    if not cache:
+        yield from r.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+        return
+    payload_path, _ = _cache_paths(url)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(payload_path))
+    try:
+        with os.fdopen(fd, "wb") as f, gzip.GzipFile(fileobj=f, mode="wb") as gz:
+            for chunk in r.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                gz.write(chunk)
+                yield chunk
+        os.replace(tmp, payload_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def dashboard_stream_records(
+    endpoint, params, key, use_json, ttl=None, max_retries=3, quiet=False
+):
+    """
+    Yield the records of the array under key in the response of endpoint,
+    decoding them while the response is still being downloaded. With quiet,
+    failures are only logged before aborting.
+    """
+    url = _dashboard_url(endpoint, params)
+    report = kci_info if quiet else kci_err
+    cache = bool(ttl) and dashboard_cache_enabled()
+    cached = dashboard_cache_load(url) if cache else None
+    if cached and dashboard_cache_fresh(cached):
+        kci_info(f"dashboard cache hit: {url}")
+        yield from _iter_json_array(_iter_cached_chunks(cached), key, use_json, quiet)
+        return
+
+    headers = {}
+    if cached and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    retries = 0
+    try:
+        while True:
+            r = dashboard_session().get(
+                url, headers=headers, stream=True, timeout=dashboard_timeout()
+            )
+            if r.status_code in DASHBOARD_RETRY_STATUS_CODES:
+                r.close()
+                retries += 1
+                if retries > max_retries:
+                    report(f"Failed after {max_retries} retries with 500 error.")
+                    raise click.Abort()
+                continue
+            break
+        with r:
+            if r.status_code == 304 and cached:
+                kci_info(f"dashboard cache revalidated: {url}")
+                etag = cached["etag"]
+                chunks = _iter_cached_chunks(cached)
+            else:
+                r.raise_for_status()
+                etag = r.headers.get("ETag")
+                chunks = _iter_response_chunks(url, r, cache)
+            # The newest record is enough to work out the ttl of the response
+            newest = None
+            for record in _iter_json_array(chunks, key, use_json, quiet):
+                start_time = record.get("start_time") or ""
+                if newest is None or start_time > (newest.get("start_time") or ""):
+                    newest = record
+                yield record
+            # Read up to the end of the body, so it gets cached
+            for _ in chunks:
+                pass
+            if cache:
+                records = [newest] if newest is not None else []
+                dashboard_cache_touch(
+                    url, {"etag": etag}, _cache_ttl(ttl, {key: records})
+                )
+    except requests.exceptions.RequestException as e:
+        report(f"Failed to fetch from {DASHBOARD_API}: {str(e)}.")
+        raise click.Abort()
+    except ValueError as e:
+        report(f"Failed to decode response from {DASHBOARD_API}: {str(e)}.")
+        raise click.Abort()
+
+
+def dashboard_stream_commit_results(
+    kind, origin, giturl, branch, commit, arch, use_json, quiet=False
+):
+    """Stream the boots or tests records of a commit one by one"""
+    endpoint = f"tree/{commit}/{kind}"
+    ttl = dashboard_commit_ttl(origin, giturl, branch, commit)
+    params = {
+        "origin": origin,
+        "git_url": giturl,
+        "git_branch": branch,
+    }
+    if arch is not None:
+        params["filter_architecture"] = arch
+    return dashboard_stream_records(
+        endpoint, params, kind, use_json, ttl=ttl, quiet=quiet
+    )
 
 
 def dashboard_fetch_test(test_id, use_json):
     endpoint = f"test/{test_id}"
-    return dashboard_api_fetch(endpoint, {}, use_json)
+    return dashboard_api_fetch(endpoint, {}, use_json, ttl=DASHBOARD_CACHE_TTL_LATEST)
 
 
 def dashboard_fetch_build(build_id, use_json):
     endpoint = f"build/{build_id}"
-    return dashboard_api_fetch(endpoint, {}, use_json)
+    return dashboard_api_fetch(endpoint, {}, use_json, ttl=DASHBOARD_CACHE_TTL_LATEST)
 
 
-def dashboard_fetch_tree_list(origin, use_json):
+def dashboard_fetch_tree_list(origin, use_json, quiet=False):
     params = {
         "origin": origin,
     }
-    return dashboard_api_fetch("tree-fast", params, use_json)
+    return dashboard_api_fetch(
+        "tree-fast", params, use_json, ttl=DASHBOARD_CACHE_TTL_TREES, quiet=quiet
+    )
 
 
 def dashboard_fetch_hardware_list(origin, use_json):
@@ -1,26 +1,179 @@
-import gzip
+import hashlib
 import os
 import re
+import shutil
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from kcidev.libs.common import kci_err
+from kcidev.libs.common import kci_cache_dir, kci_err, kci_info
 
 INVALID_FILE_CHARS = re.compile(r'[\\/:"*?<>|]+')
 
+# Logs are downloaded and decompressed in chunks of this size, so memory use
+# doesn't depend on the size of the log
+LOG_CHUNK_SIZE = 64 * 1024
+LOG_TIMEOUT = (10, 60)
+GZIP_WBITS = zlib.MAX_WBITS | 16
+
+# Number of parallel log downloads, also the size of the per-host
+# connection pool of the logs session
+DOWNLOAD_JOBS = 4
+
+_session = None
+_session_lock = threading.Lock()
+# One lock per log url, so logs shared by several results are fetched once
+_store_locks = {}
+
 
 def to_valid_filename(filename):
     return INVALID_FILE_CHARS.sub("", filename)
 
 
+def logs_session(pool_size=DOWNLOAD_JOBS):
+    """Return the session shared by log downloads, reusing connections per host"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def gunzip_to_file(chunks, file):
+    """Decompress gzip data read in chunks into file, one buffer at a time"""
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    in_member = False
+    for chunk in chunks:
+        while chunk:
+            in_member = True
+            file.write(decompressor.decompress(chunk, LOG_CHUNK_SIZE))
+            chunk = decompressor.unconsumed_tail
+            if decompressor.eof:
+                # A gzip file may hold several concatenated members
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+                in_member = False
+    if in_member:
+        raise EOFError("Compressed file ended before the end-of-stream marker")
+
+
+def _store_lock(key):
+    with _session_lock:
+        return _store_locks.setdefault(key, threading.Lock())
+
+
+def _file_chunks(path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(LOG_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _download_resume(log_url, part_file):
+    """Download log_url into part_file, resuming a previous partial download"""
+    headers = {}
+    offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    with logs_session().get(
+        log_url, headers=headers, stream=True, timeout=LOG_TIMEOUT
+    ) as r:
+        if r.status_code == 416 and offset:
+            # Nothing left to download
+            return
+        r.raise_for_status()
+        mode = "ab" if r.status_code == 206 else "wb"
+        if mode == "ab":
+            kci_info(f"Resuming download of {log_url} at {offset} bytes")
+        with open(part_file, mode) as file:
+            for chunk in r.iter_content(chunk_size=LOG_CHUNK_SIZE):
+                file.write(chunk)
+
+
+def fetch_log_to_store(log_url):
+    """
+    Return the path of the decompressed log in the local log store,
+    downloading it first if it isn't there yet. Logs are stored by url hash.
+    """
+    key = hashlib.sha256(log_url.encode()).hexdigest()
+    store = kci_cache_dir("logs")
+    log_path = os.path.join(store, key + ".log")
+    part_file = os.path.join(store, key + ".gz.part")
+    with _store_lock(key):
+        if os.path.exists(log_path):
+            kci_info(f"Log already in store: {log_url}")
+            return log_path
+        _download_resume(log_url, part_file)
+        tmp_path = log_path + ".tmp"
+        try:
+            with open(tmp_path, mode="wb") as file:
+                gunzip_to_file(_file_chunks(part_file), file)
+        except (OSError, EOFError, zlib.error):
+            # Corrupted download, start from scratch next time
+            for path in [tmp_path, part_file]:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        os.replace(tmp_path, log_path)
+        os.remove(part_file)
+        return log_path
+
+
+def link_log_file(store_path, log_file):
+    """Make log_file point to store_path, without copying it if possible"""
+    if os.path.lexists(log_file):
+        os.remove(log_file)
+    try:
+        os.link(store_path, log_file)
+    except OSError:
+        try:
+            os.symlink(store_path, log_file)
+        except OSError:
+            shutil.copyfile(store_path, log_file)
+
+
 def download_logs_to_file(log_url, log_file):
     try:
-        log_gz = requests.get(log_url)
-        log = gzip.decompress(log_gz.content)
         log_file = to_valid_filename(log_file)
-        with open(log_file, mode="wb") as file:
-            file.write(log)
+        store_path = fetch_log_to_store(log_url)
+        link_log_file(store_path, log_file)
         log_path = "file://" + os.path.join(os.getcwd(), log_file)
         return log_path
     except:
         kci_err(f"Failed to fetch log {log_url}.")
+
+
+def download_logs_ordered(items, log_request, jobs=DOWNLOAD_JOBS):
+    """
+    Download the logs of items with a pool of jobs workers, yielding
+    (item, log_path) in the order of items as soon as each log is ready.
+    log_request(item) returns the (log_url, log_file) of an item.
+    """
+    jobs = max(1, jobs)
+    logs_session(jobs)
+
+    def download(item):
+        log_url, log_file = log_request(item)
+        return download_logs_to_file(log_url, log_file)
+
+    # Keep a bounded window of downloads ahead of the item being displayed
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for item in items:
+            pending.append((item, executor.submit(download, item)))
+            if len(pending) >= 2 * jobs:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
@@ -2,14 +2,187 @@
 # -*- coding: utf-8 -*-
 
 import errno
+import hashlib
 import json
+import os
+import random
+import re
+import tempfile
+import threading
 import time
+import urllib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 
 import click
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from kcidev.libs.common import *
 
+MAESTRO_POOL_SIZE = 10
+MAESTRO_CONNECT_TIMEOUT = 10
+MAESTRO_READ_TIMEOUT = 30
+MAESTRO_RETRIES = 3
+MAESTRO_RETRY_STATUS_CODES = [502, 503, 504]
+# Number of done nodes kept in memory, the least recently used are dropped
+MAESTRO_NODE_CACHE_SIZE = 1024
+
+
+class MaestroClient:
+    """
+    Client of a Maestro instance: a pooled session, so that API calls (and
+    long watch loops) reuse keep-alive connections, with the default headers,
+    timeouts and retry policy of the instance. Connection errors, and gateway
+    errors of GET requests, are retried with backoff.
+
+    Nodes in the done state never change anymore: the ones fetched one by one
+    are cached in memory (up to MAESTRO_NODE_CACHE_SIZE of them), and on disk
+    with node_cache, to get them again without API requests.
+    """
+
+    def __init__(
+        self,
+        token=None,
+        pool_size=MAESTRO_POOL_SIZE,
+        connect_timeout=MAESTRO_CONNECT_TIMEOUT,
+        read_timeout=MAESTRO_READ_TIMEOUT,
+        retries=MAESTRO_RETRIES,
+        node_cache=False,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.nodes = OrderedDict()
+        self.node_cache_dir = None
+        if node_cache:
+            try:
+                self.node_cache_dir = kci_cache_dir("maestro", "nodes")
+            except OSError as e:
+                kci_info(f"Failed to create the node cache directory: {e}")
+        self.retries = retries
+        self.pool_size = 0
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers["Content-Type"] = "application/json; charset=utf-8"
+        if token:
+            self.session.headers["Authorization"] = f"{token}"
+        self.set_pool_size(pool_size)
+
+    def set_pool_size(self, pool_size):
+        """Grow the connection pool, e.g. for the number of concurrent watchers"""
+        with self.lock:
+            if pool_size <= self.pool_size:
+                return
+            retry = Retry(
+                total=self.retries,
+                # a read timeout may be expected, e.g. when listening to events
+                read=False,
+                status_forcelist=MAESTRO_RETRY_STATUS_CODES,
+                backoff_factor=1,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+            )
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self.pool_size = pool_size
+
+    def request(self, method, url, token=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if token:
+            kwargs["headers"] = {
+                "Authorization": f"{token}",
+                **kwargs.get("headers", {}),
+            }
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def _node_cache_path(self, node_url):
+        name = hashlib.sha256(node_url.encode()).hexdigest() + ".json"
+        return os.path.join(self.node_cache_dir, name)
+
+    def cached_node(self, node_url):
+        """Return the cached done node at node_url, or None"""
+        with self.lock:
+            node = self.nodes.get(node_url)
+            if node is not None:
+                self.nodes.move_to_end(node_url)
+        if node is not None or not self.node_cache_dir:
+            return node
+        try:
+            with open(self._node_cache_path(node_url), "r") as f:
+                node = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(node_url, node)
+        return node
+
+    def _remember(self, node_url, node):
+        with self.lock:
+            self.nodes[node_url] = node
+            self.nodes.move_to_end(node_url)
+            if len(self.nodes) > MAESTRO_NODE_CACHE_SIZE:
+                self.nodes.popitem(last=False)
+
+    def cache_node(self, node_url, node):
+        """Cache node, if it is done"""
+        if not isinstance(node, dict) or node.get("state") != "done":
+            return
+        with self.lock:
+            if node_url in self.nodes:
+                return
+        self._remember(node_url, node)
+        if self.node_cache_dir:
+            tmp = None
+            try:
+                fd, tmp = tempfile.mkstemp(dir=self.node_cache_dir)
+                with os.fdopen(fd, "w") as f:
+                    json.dump(node, f)
+                os.replace(tmp, self._node_cache_path(node_url))
+            except OSError as e:
+                kci_info(f"Failed to cache {node_url}: {e}")
+                if tmp and os.path.exists(tmp):
+                    os.unlink(tmp)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def maestro_set_client(cfg, instance):
+    """
+    Create the client of the instance, with the maestro_* options of the
+    instance section of the settings file
+    """
+    global _client
+    section = cfg.get(instance, {}) if cfg and instance else {}
+    client = MaestroClient(
+        token=section.get("token"),
+        pool_size=section.get("maestro_pool_size", MAESTRO_POOL_SIZE),
+        connect_timeout=section.get("maestro_connect_timeout", MAESTRO_CONNECT_TIMEOUT),
+        read_timeout=section.get("maestro_read_timeout", MAESTRO_READ_TIMEOUT),
+        retries=section.get("maestro_retries", MAESTRO_RETRIES),
+        node_cache=section.get("maestro_node_cache", False),
+    )
+    with _client_lock:
+        _client = client
+
+
+def maestro_client():
+    """Return the client of the instance, shared by all Maestro API calls"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MaestroClient()
+        return _client
+
 
 def maestro_print_api_call(host, data=None):
     kci_info("maestro api endpoint: " + host)
@@ -28,28 +201,53 @@ def maestro_api_error(response):
     return
 
 
-def maestro_print_nodes(nodes, field):
-    res = []
-    if not isinstance(nodes, list):
+def maestro_project_node(node, field):
+    """Keep only the given fields of node"""
+    if not field:
+        return node
+    return {f: node.get(f) for f in field}
+
+
+def maestro_print_nodes(nodes, field, ndjson=False):
+    """
+    Print nodes as a json list, or one json node per line with ndjson.
+    Each node is serialized once, as soon as it is available, so nodes
+    can be any iterable, e.g. maestro_iter_nodes.
+    """
+    if isinstance(nodes, dict):
         nodes = [nodes]
+    if ndjson:
+        for node in nodes:
+            kci_msg(json.dumps(maestro_project_node(node, field), sort_keys=True))
+        return
+    # same output as json.dumps(list(nodes), sort_keys=True, indent=4)
+    # a node is written once the next one is known, to end it with a comma
+    previous = None
     for node in nodes:
-        if field:
-            data = {}
-            for f in field:
-                data[f] = node.get(f)
-            res.append(data)
+        data = json.dumps(maestro_project_node(node, field), sort_keys=True, indent=4)
+        if previous is None:
+            kci_msg_buffered("[")
         else:
-            res.append(node)
-        kci_msg(json.dumps(res, sort_keys=True, indent=4))
+            kci_msg_buffered(previous + ",")
+        previous = "    " + data.replace("\n", "\n    ")
+    if previous is None:
+        kci_msg_buffered("[]")
+    else:
+        kci_msg_buffered(previous + "\n]")
+    kci_flush()
+
+
+def maestro_node_url(url, nodeid):
+    return url + "latest/node/" + nodeid
 
 
 def maestro_get_node(url, nodeid):
-    headers = {
-        "Content-Type": "application/json; charset=utf-8",
-    }
-    url = url + "latest/node/" + nodeid
+    url = maestro_node_url(url, nodeid)
+    node = maestro_client().cached_node(url)
+    if node is not None:
+        return node
     maestro_print_api_call(url)
-    response = requests.get(url, headers=headers)
+    response = maestro_client().get(url)
     try:
         response.raise_for_status()
     except requests.exceptions.HTTPError as ex:
@@ -59,22 +257,93 @@ def maestro_get_node(url, nodeid):
         kci_err(ex)
         sys.exit(errno.ENOENT)
 
-    return response.json()
+    node = response.json()
+    maestro_client().cache_node(url, node)
+    return node
+
+
+# Filter operators, and the API query operator they translate to
+FILTER_OPERATORS = {
+    "!=": "ne",
+    ">=": "gte",
+    "<=": "lte",
+    ">": "gt",
+    "<": "lt",
+    "~": "re",
+    "*=": "re",
+    "=": None,
+}
+FILTER_API_OPERATORS = {"ne", "gt", "lt", "gte", "lte", "re"}
+FILTER_DATE_FIELDS = {"created", "updated", "timeout"}
+FILTER_RE = re.compile(r"^([A-Za-z_][\w.]*)(!=|>=|<=|\*=|=|>|<|~)(.*)$")
+FILTER_DATE_FRACTION_RE = re.compile(r"\.(\d+)(?=[+-]\d{2}:\d{2}$|$)")
+
+
+def maestro_filter_value(key, operator, value):
+    """Validate the value of a filter, raise ValueError if not valid"""
+    if operator == "re":
+        try:
+            re.compile(value)
+        except re.error as ex:
+            raise ValueError(f"invalid regular expression {value!r}: {ex}")
+    elif key in FILTER_DATE_FIELDS:
+        # fromisoformat() before Python 3.11 only knows about +00:00 and
+        # fractions of 3 or 6 digits, normalise the value before parsing
+        date = value[:-1] + "+00:00" if value.endswith("Z") else value
+        date = FILTER_DATE_FRACTION_RE.sub(
+            lambda match: "." + match.group(1)[:6].ljust(6, "0"), date
+        )
+        try:
+            datetime.fromisoformat(date)
+        except ValueError:
+            raise ValueError(f"invalid date {value!r} for {key}")
+    return value
+
+
+def maestro_filter_params(filters):
+    """
+    Translate filter expressions to API query parameters, as a list of
+    (key, value). Supported expressions are key=value, key!=value, key>value,
+    key<value, key>=value, key<=value, key~regex, key*=substring, and for
+    dates a range key=from..to where from or to can be left out. API query
+    operators (key__gte=value) are accepted as well. Raise ValueError on
+    invalid filters.
+    """
+    params = []
+    for expression in filters or []:
+        match = FILTER_RE.match(expression)
+        if not match or not match.group(3):
+            raise ValueError(f"invalid filter {expression!r}")
+        key, symbol, value = match.groups()
+        operator = FILTER_OPERATORS[symbol]
+        if "__" in key:
+            key, api_operator = key.rsplit("__", 1)
+            if api_operator not in FILTER_API_OPERATORS or operator:
+                raise ValueError(f"invalid filter operator in {expression!r}")
+            operator = api_operator
+        if symbol == "*=":
+            value = re.escape(value)
+        if symbol == "=" and key in FILTER_DATE_FIELDS and ".." in value:
+            start, end = value.split("..", 1)
+            if not start and not end:
+                raise ValueError(f"invalid range in {expression!r}")
+            if start:
+                params.append((f"{key}__gte", maestro_filter_value(key, "gte", start)))
+            if end:
+                params.append((f"{key}__lte", maestro_filter_value(key, "lte", end)))
+            continue
+        value = maestro_filter_value(key, operator, value)
+        params.append((f"{key}__{operator}" if operator else key, value))
+    return params
 
 
-def maestro_get_nodes(url, limit, offset, filter):
-    headers = {
-        "Content-Type": "application/json; charset=utf-8",
-    }
-    url = url + "latest/nodes/fast?limit=" + str(limit) + "&offset=" + str(offset)
-    maestro_print_api_call(url)
-    if filter:
-        for f in filter:
-            # TBD: We need to add translate filter to API
-            # if we need anything more complex than eq(=)
-            url = url + "&" + f
+def maestro_get_nodes(url, limit, offset, params):
+    """Get a page of nodes, params are from maestro_filter_params"""
+    query = [("limit", limit), ("offset", offset)] + list(params or [])
+    nodes_url = url + "latest/nodes/fast?" + urllib.parse.urlencode(query)
+    maestro_print_api_call(nodes_url)
 
-    response = requests.get(url, headers=headers)
+    response = maestro_client().get(nodes_url)
     try:
         response.raise_for_status()
     except requests.exceptions.HTTPError as ex:
@@ -87,6 +356,86 @@ def maestro_get_nodes(url, limit, offset, filter):
     return response.json()
 
 
+def maestro_iter_nodes(url, limit, offset, params, jobs=4):
+    """
+    Yield all nodes matching params, page by page from offset. Up to jobs
+    pages are fetched ahead concurrently, the iteration stops on the first
+    page shorter than limit.
+    """
+    maestro_client().set_pool_size(jobs)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        next_offset = offset
+        try:
+            while True:
+                while len(pending) < jobs:
+                    pending.append(
+                        executor.submit(
+                            maestro_get_nodes, url, limit, next_offset, params
+                        )
+                    )
+                    next_offset += limit
+                page = pending.popleft().result()
+                yield from page
+                if len(page) < limit:
+                    return
+        finally:
+            # pages past the end are not needed anymore
+            for future in pending:
+                future.cancel()
+
+
+MAESTRO_SUBTREE_PAGE = 1000
+
+
+def maestro_get_subtree(url, nodeid, depth=None, jobs=4):
+    """
+    Get a node and its descendants, up to depth levels below it, in
+    breadth-first order. All the nodes of its tree are fetched in pages of
+    MAESTRO_SUBTREE_PAGE nodes (jobs of them concurrently), and the
+    descendants are picked from them.
+    """
+    root = maestro_get_node(url, nodeid)
+    if not root.get("treeid"):
+        kci_warning(f"Node {nodeid} has no treeid, can't get the nodes below it")
+        return [root]
+    children = {}
+    params = [("treeid", root["treeid"])]
+    for node in maestro_iter_nodes(url, MAESTRO_SUBTREE_PAGE, 0, params, jobs):
+        children.setdefault(node.get("parent"), []).append(node)
+    nodes = [root]
+    seen = {root["id"]}
+    level = [root]
+    level_depth = 0
+    while level and (depth is None or level_depth < depth):
+        parents = level
+        level = []
+        for parent in parents:
+            for child in children.get(parent["id"], []):
+                if child["id"] not in seen:
+                    seen.add(child["id"])
+                    level.append(child)
+        nodes.extend(level)
+        level_depth += 1
+    return nodes
+
+
+def maestro_nest_nodes(nodes, field):
+    """
+    Nest the nodes of maestro_get_subtree under their parent, in a
+    "children" list. Return the root node.
+    """
+    nested = {}
+    for node in nodes:
+        data = dict(maestro_project_node(node, field))
+        data["children"] = []
+        parent = nested.get(node.get("parent"))
+        if parent is not None:
+            parent["children"].append(data)
+        nested[node["id"]] = data
+    return nested[nodes[0]["id"]]
+
+
 def maestro_check_node(node):
     """
     Node can be defined RUNNING/DONE/FAIL based on the state
@@ -113,14 +462,13 @@ def maestro_check_node(node):
             return "FAIL"
 
 
-def maestro_retrieve_treeid_nodes(baseurl, token, treeid):
+def maestro_retrieve_treeid_nodes(baseurl, token, treeid, updated_since=None):
     url = baseurl + "latest/nodes/fast?treeid=" + treeid
-    headers = {
-        "Content-Type": "application/json; charset=utf-8",
-        "Authorization": f"{token}",
-    }
+    if updated_since:
+        # Only nodes updated since the last poll
+        url += "&updated__gte=" + urllib.parse.quote(updated_since)
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = maestro_client().get(url, token=token)
     except requests.exceptions.RequestException as e:
         click.secho(f"API connection error: {e}, retrying...", fg="yellow")
         return None
@@ -135,7 +483,134 @@ def maestro_retrieve_treeid_nodes(baseurl, token, treeid):
     return response.json()
 
 
-def maestro_node_result(node):
+# Longest time a watcher given a stop event blocks without checking it
+MAESTRO_STOP_CHECK_INTERVAL = 10
+
+
+class MaestroWatchStopped(Exception):
+    """Raised by a watcher whose stop event was set"""
+
+
+def maestro_sleep(seconds, stop=None):
+    """Sleep for seconds, or raise MaestroWatchStopped once stop is set"""
+    if stop is None:
+        time.sleep(seconds)
+    elif stop.wait(seconds):
+        raise MaestroWatchStopped()
+
+
+def maestro_subscribe(baseurl, token, channel="node"):
+    """Subscribe to an API events channel, return the subscription id"""
+    url = baseurl + "latest/subscribe/" + channel
+    maestro_print_api_call(url)
+    try:
+        response = maestro_client().post(url, token=token)
+    except requests.exceptions.RequestException as e:
+        kci_warning(f"API connection error: {e}")
+        return None
+    if response.status_code >= 400:
+        maestro_api_error(response)
+        return None
+    try:
+        return response.json()["id"]
+    except (ValueError, KeyError, TypeError):
+        kci_warning(f"Unexpected subscription response: {response.text}")
+        return None
+
+
+def maestro_unsubscribe(baseurl, token, sub_id):
+    url = baseurl + "latest/unsubscribe/" + str(sub_id)
+    try:
+        maestro_client().post(url, token=token)
+    except requests.exceptions.RequestException:
+        pass
+
+
+def maestro_listen(baseurl, token, sub_id, timeout):
+    """
+    Wait up to timeout seconds for the next event of a subscription.
+    Return the event data, {} if no event came in time, None on errors.
+    """
+    url = baseurl + "latest/listen/" + str(sub_id)
+    try:
+        response = maestro_client().get(
+            url, token=token, timeout=(maestro_client().timeout[0], timeout)
+        )
+    except requests.exceptions.ReadTimeout:
+        return {}
+    except requests.exceptions.RequestException as e:
+        kci_warning(f"API connection error: {e}")
+        return None
+    if response.status_code >= 400:
+        maestro_api_error(response)
+        return None
+    try:
+        # The message data is a json encoded CloudEvent, whose data is the node
+        event = response.json().get("data")
+        if isinstance(event, str):
+            event = json.loads(event)
+        if isinstance(event, dict) and isinstance(event.get("data"), dict):
+            event = event["data"]
+        return event if isinstance(event, dict) else {}
+    except (ValueError, AttributeError):
+        kci_warning(f"Unexpected event: {response.text}")
+        return {}
+
+
+def maestro_event_relevant(event, treeid, names, nodes_index):
+    """Check if a node event might be about one of the nodes being watched"""
+    if event.get("treeid"):
+        return event["treeid"] == treeid
+    if event.get("id") in nodes_index:
+        return True
+    # Events without treeid, about a node not seen yet
+    return event.get("name") in names
+
+
+def maestro_wait_event(
+    baseurl, token, sub_id, treeid, names, nodes_index, timeout, stop=None
+):
+    """
+    Wait up to timeout seconds for an event about the watched tree.
+    Return False if events can't be received anymore.
+    """
+    deadline = time.time() + timeout
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return True
+        if stop is not None:
+            if stop.is_set():
+                raise MaestroWatchStopped()
+            # listen in shorter steps, to notice the stop event soon enough
+            remaining = min(remaining, MAESTRO_STOP_CHECK_INTERVAL)
+        event = maestro_listen(baseurl, token, sub_id, remaining)
+        if event is None:
+            return False
+        if event and maestro_event_relevant(event, treeid, names, nodes_index):
+            kci_info(f"Node event: {event.get('id')} {event.get('state')}")
+            return True
+
+
+def maestro_merge_nodes(nodes_index, nodes):
+    """
+    Merge nodes into nodes_index (nodes by id), return True if any node
+    was added or changed
+    """
+    changed = False
+    for node in nodes:
+        if nodes_index.get(node["id"]) != node:
+            nodes_index[node["id"]] = node
+            changed = True
+    return changed
+
+
+def maestro_nodes_cursor(nodes_index):
+    """Return the latest update time of the indexed nodes"""
+    return max((node["updated"] for node in nodes_index.values()), default=None)
+
+
+def maestro_node_result(node, label=None):
     result = node["result"]
     if node["kind"] == "checkout":
         if (
@@ -144,105 +619,306 @@ def maestro_node_result(node):
             or result == "done"
             or result == "pass"
         ):
-            kci_msg_green_nonl("PASS")
+            status = kci_style("PASS", "green")
         elif result == None:
-            kci_msg_green_nonl("PASS")
+            status = kci_style("PASS", "green")
         else:
-            kci_msg_red_nonl("FAIL")
+            status = kci_style("FAIL", "red")
     else:
         if node["result"] == "pass":
-            kci_msg_green_nonl("PASS")
+            status = kci_style("PASS", "green")
         elif node["result"] == "fail":
-            kci_msg_red_nonl("FAIL")
+            status = kci_style("FAIL", "red")
         else:
-            kci_msg_yellow_nonl(node["result"])
+            status = kci_style(str(node["result"]), "bright_yellow")
 
     if node["kind"] == "checkout":
-        kci_msg_nonl(" branch checkout")
+        job = " branch checkout"
     else:
-        kci_msg_nonl(f" {node['kind']}: ")
+        job = f" {node['kind']}: {node['name']}"
+
+    line = f"{status}{job} - node_id:{node['id']} ({node['updated']})"
+    # written at once, as several watchers might share the terminal
+    kci_msg(f"[{label}] {line}" if label else line)
 
-    if node["kind"] != "checkout":
-        kci_msg_nonl(f"{node['name']}")
 
-    kci_msg(f" - node_id:{node['id']} ({node['updated']})")
+class PollScheduler:
+    """
+    Adaptive interval between watch polls: poll fast right after a checkout
+    and when the watch is about to complete, back off exponentially
+    while nothing changes, and add jitter so concurrent watchers spread out
+    """
+
+    def __init__(
+        self,
+        fast=5,
+        slow=30,
+        max_interval=180,
+        backoff=1.5,
+        jitter=0.2,
+        warmup=120,
+    ):
+        self.fast = fast
+        self.slow = slow
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.warmup_end = time.time() + warmup
+        self.idle_polls = 0
+        self.near_completion = False
+
+    def update(self, changed, near_completion=None):
+        """Record the outcome of a poll"""
+        self.idle_polls = 0 if changed else self.idle_polls + 1
+        if near_completion is not None:
+            self.near_completion = near_completion
+
+    def next_interval(self):
+        if self.near_completion or time.time() < self.warmup_end:
+            interval = self.fast
+        else:
+            interval = min(self.slow * self.backoff**self.idle_polls, self.max_interval)
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
 
+    def retry_interval(self):
+        """Interval before retrying a failed poll"""
+        return self.fast * random.uniform(1 - self.jitter, 1 + self.jitter)
 
-def maestro_watch_jobs(baseurl, token, treeid, job_filter, test):
+
+def maestro_watch_tree(
+    baseurl, token, treeid, job_filter, test, events=False, label=None, stop=None
+):
+    """
+    Watch the jobs of a tree until they complete. Return None when all jobs
+    are done, or with a test: 0 if it passed, 1 if it failed, and 2 if a job
+    it depends on failed. With a label, messages are prefixed with it and
+    progress output is left out, so several trees can be watched at once.
+    With a stop event, MaestroWatchStopped is raised once it is set.
+    """
     # we need to add to job_filter "checkout" node
     job_filter = list(job_filter)
     job_filter.append("checkout")
-    kci_log(f"job_filter: {', '.join(job_filter)}")
-    previous_nodes = None
-    running = False
-
-    job_info = {}
-    for job in job_filter:
-        job_info[job] = {"done": False, "running": False}
+    prefix = f"[{label}] " if label else ""
+    kci_log(f"{prefix}job_filter: {', '.join(job_filter)}")
+    names = job_filter + [test] if test else job_filter
+    # With events, wake up as soon as a node of the tree is updated instead of
+    # sleeping for the whole poll interval
+    sub_id = None
+    if events:
+        sub_id = maestro_subscribe(baseurl, token)
+        if not sub_id:
+            kci_warning("Failed to subscribe to node events, polling instead")
+
+    def wait(seconds):
+        nonlocal sub_id
+        if sub_id:
+            if maestro_wait_event(
+                baseurl, token, sub_id, treeid, names, nodes_index, seconds, stop
+            ):
+                return
+            kci_warning("Lost node events subscription, polling instead")
+            sub_id = None
+        maestro_sleep(seconds, stop)
 
-    while True:
-        inprogress = 0
-        joblist = job_filter.copy()
-        nodes = maestro_retrieve_treeid_nodes(baseurl, token, treeid)
-        if not nodes:
-            kci_warning("No nodes found. Retrying...")
-            time.sleep(5)
-            continue
-        if previous_nodes == nodes:
-            kci_msg_nonl(".")
-            time.sleep(30)
-            continue
+    try:
+        # All nodes of the tree by id, updated with the nodes changed since the
+        # latest update seen (cursor) on every poll
+        nodes_index = {}
+        cursor = None
+        running = False
 
-        time_local = time.localtime()
-        kci_info(f"\nCurrent time: {time.strftime('%Y-%m-%d %H:%M:%S', time_local)}")
+        job_info = {}
+        for job in job_filter:
+            job_info[job] = {"done": False, "running": False}
 
-        # Tricky part in watch is that we might have one item in job_filter (job, test),
-        # but it might spawn multiple nodes with same name
-        test_result = None
         jobs_done_ts = None
-        for node in nodes:
-            if node["name"] == test:
-                test_result = node["result"]
-            if node["name"] in job_filter:
-                status = maestro_check_node(node)
-                if status == "DONE":
-                    if job_info[node["name"]]["running"]:
-                        kci_msg("")
-                        job_info[node["name"]]["running"] = False
-                    if not job_info[node["name"]]["done"]:
-                        maestro_node_result(node)
-                        job_info[node["name"]]["done"] = True
-                    if isinstance(joblist, list) and node["name"] in joblist:
-                        joblist.remove(node["name"])
-                elif status == "RUNNING":
-                    job_info[node["name"]]["running"] = True
-                    inprogress += 1
+        scheduler = PollScheduler()
+        while True:
+            inprogress = 0
+            joblist = job_filter.copy()
+            nodes = maestro_retrieve_treeid_nodes(baseurl, token, treeid, cursor)
+            if nodes is None or (not nodes and not nodes_index):
+                kci_warning(f"{prefix}No nodes found. Retrying...")
+                maestro_sleep(scheduler.retry_interval(), stop)
+                continue
+            changed = maestro_merge_nodes(nodes_index, nodes)
+            cursor = maestro_nodes_cursor(nodes_index)
+            if not changed:
+                scheduler.update(False)
+                if not label:
+                    kci_msg_nonl(".")
+                wait(scheduler.next_interval())
+                continue
+
+            time_local = time.localtime()
+            kci_info(
+                f"\nCurrent time: {time.strftime('%Y-%m-%d %H:%M:%S', time_local)}"
+            )
+
+            # Tricky part in watch is that we might have one item in job_filter (job, test),
+            # but it might spawn multiple nodes with same name
+            test_result = None
+            for node in nodes_index.values():
+                if node["name"] == test:
+                    test_result = node["result"]
+                if node["name"] in job_filter:
+                    status = maestro_check_node(node)
+                    if status == "DONE":
+                        if job_info[node["name"]]["running"]:
+                            if not label:
+                                kci_msg("")
+                            job_info[node["name"]]["running"] = False
+                        if not job_info[node["name"]]["done"]:
+                            maestro_node_result(node, label)
+                            job_info[node["name"]]["done"] = True
+                        if isinstance(joblist, list) and node["name"] in joblist:
+                            joblist.remove(node["name"])
+                    elif status == "RUNNING":
+                        job_info[node["name"]]["running"] = True
+                        inprogress += 1
+                    else:
+                        if isinstance(joblist, list) and node["name"] in joblist:
+                            joblist.remove(node["name"])
+                        # if test is same as job, dont indicate infra-failure if test job fail
+                        if test and test != node["name"]:
+                            # if we have a test, and prior job failed, we should indicate that
+                            kci_err(
+                                f"{prefix}Job {node['name']} failed, test can't be executed"
+                            )
+                            return 2
+            jobs_done = len(joblist) == 0 and inprogress == 0
+            # The jobs are done, only the test result is still to come
+            scheduler.update(True, near_completion=jobs_done and not test_result)
+            if jobs_done:
+                kci_info(f"{prefix}All jobs completed")
+                if not test:
+                    return None
                 else:
-                    if isinstance(joblist, list) and node["name"] in joblist:
-                        joblist.remove(node["name"])
-                    # if test is same as job, dont indicate infra-failure if test job fail
-                    if test and test != node["name"]:
-                        # if we have a test, and prior job failed, we should indicate that
-                        kci_err(f"Job {node['name']} failed, test can't be executed")
-                        sys.exit(2)
-        if isinstance(joblist, list) and len(joblist) == 0 and inprogress == 0:
-            kci_info("All jobs completed")
-            if not test:
-                return
-            else:
-                if not jobs_done_ts:
-                    jobs_done_ts = time.time()
-                # if all jobs done, usually test results must be available
-                # max within 60s. Safeguard in case of test node is not available
-                if not test_result and time.time() - jobs_done_ts < 60:
-                    continue
-
-                if test_result and test_result == "pass":
-                    sys.exit(0)
-                elif test_result:
-                    sys.exit(1)
-
-        running = True
-        kci_msg_nonl(f"\rRunning job...")
-        previous_nodes = nodes
-        time.sleep(30)
+                    if not jobs_done_ts:
+                        jobs_done_ts = time.time()
+                    # if all jobs done, usually test results must be available
+                    # max within 60s. Safeguard in case of test node is not available
+                    if not test_result and time.time() - jobs_done_ts < 60:
+                        continue
+
+                    if test_result and test_result == "pass":
+                        return 0
+                    elif test_result:
+                        return 1
+
+            running = True
+            if not label:
+                kci_msg_nonl(f"\rRunning job...")
+            wait(scheduler.next_interval())
+    finally:
+        if sub_id:
+            maestro_unsubscribe(baseurl, token, sub_id)
+
+
+def maestro_node_job(node, nodes_index):
+    """Return the job node that node belongs to, None if not found"""
+    while node is not None and node.get("kind") != "job":
+        node = nodes_index.get(node.get("parent"))
+    return node
+
+
+def maestro_tree_index(baseurl, token, treeid):
+    """Return all the nodes of a tree, by id, None on errors"""
+    nodes = maestro_retrieve_treeid_nodes(baseurl, token, treeid)
+    if nodes is None:
+        return None
+    nodes_index = {}
+    maestro_merge_nodes(nodes_index, nodes)
+    return nodes_index
+
+
+def maestro_watch_retries(
+    baseurl, token, job, test, count, known, label=None, stop=None
+):
+    """
+    Wait for count retries of a job node to complete. Retries are the nodes
+    of the same job on the same platform and under the same parent as job,
+    that are not in known (the ids of the nodes of the tree before retrying).
+    Return the results of test in job and its retries, by job node id (None
+    when a run has no result for the test).
+    """
+    prefix = f"[{label}] " if label else ""
+    platform = (job.get("data") or {}).get("platform")
+    nodes_index = {}
+    cursor = None
+    jobs_done_ts = None
+    scheduler = PollScheduler()
+    while True:
+        nodes = maestro_retrieve_treeid_nodes(baseurl, token, job["treeid"], cursor)
+        if nodes is None:
+            maestro_sleep(scheduler.retry_interval(), stop)
+            continue
+        changed = maestro_merge_nodes(nodes_index, nodes)
+        cursor = maestro_nodes_cursor(nodes_index)
+        retries = [
+            node
+            for node in nodes_index.values()
+            if node["kind"] == "job"
+            and node["name"] == job["name"]
+            and node.get("parent") == job.get("parent")
+            and (node.get("data") or {}).get("platform") == platform
+            and node["id"] not in known
+        ]
+        results = {run["id"]: None for run in [job] + retries}
+        for node in nodes_index.values():
+            if node["name"] == test and node.get("result"):
+                run = maestro_node_job(node, nodes_index)
+                if run and run["id"] in results:
+                    results[run["id"]] = node["result"]
+        done = [run for run in retries if run["state"] == "done"]
+        if len(done) >= count:
+            if None not in results.values():
+                return results
+            # as in maestro_watch_tree, wait max 60s for the test results
+            if not jobs_done_ts:
+                jobs_done_ts = time.time()
+            elif time.time() - jobs_done_ts > 60:
+                return results
+        scheduler.update(changed, near_completion=len(done) >= count)
+        if changed:
+            kci_log(f"{prefix}{len(done)}/{count} retries of {job['name']} done")
+        maestro_sleep(scheduler.next_interval(), stop)
+
+
+def maestro_watch_jobs(baseurl, token, treeid, job_filter, test, events=False):
+    status = maestro_watch_tree(baseurl, token, treeid, job_filter, test, events)
+    if status is not None:
+        sys.exit(status)
+
+
+def maestro_watch_trees(baseurl, token, treeids, job_filter, test, events=False):
+    """
+    Watch several trees concurrently, sharing the connection pool.
+    Return the watch status of each tree, see maestro_watch_tree. If a
+    watcher fails, or on interrupt, the other watchers are stopped.
+    """
+    maestro_client().set_pool_size(len(treeids))
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(treeids))
+    try:
+        futures = {
+            executor.submit(
+                maestro_watch_tree,
+                baseurl,
+                token,
+                treeid,
+                job_filter,
+                test,
+                events,
+                treeid[:12],
+                stop,
+            ): treeid
+            for treeid in treeids
+        }
+        statuses = {}
+        for future in as_completed(futures):
+            statuses[futures[future]] = future.result()
+        return {treeid: statuses[treeid] for treeid in treeids}
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
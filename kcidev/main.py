@@ -6,6 +6,7 @@ import logging
 import click
 
 from kcidev.libs.common import *
+from kcidev.libs.maestro_common import maestro_set_client
 from kcidev.subcommands import (
     bisect,
     checkout,
@@ -41,7 +42,13 @@ def cli(ctx, settings, instance, debug):
     subcommand = ctx.invoked_subcommand
     ctx.obj = {"CFG": load_toml(settings, subcommand)}
     ctx.obj["SETTINGS"] = settings
-    if subcommand != "results" and subcommand != "config":
+    if subcommand == "results":
+        # results works without a config file, but an instance can still
+        # tune the dashboard connection settings
+        ctx.obj["INSTANCE"] = instance
+        if not instance and ctx.obj["CFG"]:
+            ctx.obj["INSTANCE"] = ctx.obj["CFG"].get("default_instance")
+    elif subcommand != "config":
         if instance:
             ctx.obj["INSTANCE"] = instance
         else:
@@ -53,7 +60,7 @@ def cli(ctx, settings, instance, debug):
         if ctx.obj["INSTANCE"] not in ctx.obj["CFG"]:
             kci_err(f"Instance {ctx.obj['INSTANCE']} not found in {fconfig}")
             raise click.Abort()
-        pass
+        maestro_set_client(ctx.obj["CFG"], ctx.obj["INSTANCE"])
 
 
 def run():
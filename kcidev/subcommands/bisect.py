@@ -6,12 +6,18 @@ import os
 import re
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import click
 import requests
 from git import Repo
 
 from kcidev.libs.common import *
+from kcidev.libs.dashboard import *
+from kcidev.libs.maestro_common import *
+from kcidev.subcommands.checkout import send_checkout_full
+from kcidev.subcommands.testretry import send_jobretry
 
 """
 To not lose the state of the bisection, we need to store the state in a file
@@ -21,12 +27,18 @@ The state file is a json file that contains the following keys:
 - good: the known good commit
 - bad: the known bad commit
 - retry_fail: the number of times to retry the failed test
+- retry_pass: retry the passed test as well
 - history: the list of commits that have been tested (each entry has "commitid": state)
+- candidates: with --parallel, the commits of the current round, by commit, with
+  the treeid of their checkout once triggered, and their result or None while
+  in flight
+- speculative: with --speculative, the next commit already triggered, with its treeid
 """
 default_state = {
     "giturl": "",
     "branch": "",
     "retry_fail": 0,
+    "retry_pass": False,
     "good": "",
     "bad": "",
     "history": [],
@@ -36,6 +48,8 @@ default_state = {
     "workdir": "",
     "bisect_init": False,
     "next_commit": None,
+    "candidates": {},
+    "speculative": {},
 }
 
 
@@ -54,6 +68,7 @@ def print_state(state):
     click.secho("good: " + state["good"], fg="green")
     click.secho("bad: " + state["bad"], fg="green")
     click.secho("retry_fail: " + str(state["retry_fail"]), fg="green")
+    click.secho("retry_pass: " + str(state.get("retry_pass")), fg="green")
     click.secho("history: " + str(state["history"]), fg="green")
     click.secho("job_filter: " + str(state["job_filter"]), fg="green")
     click.secho("platform_filter: " + str(state["platform_filter"]), fg="green")
@@ -61,6 +76,7 @@ def print_state(state):
     click.secho("workdir: " + state["workdir"], fg="green")
     click.secho("bisect_init: " + str(state["bisect_init"]), fg="green")
     click.secho("next_commit: " + str(state["next_commit"]), fg="green")
+    click.secho("candidates: " + str(state.get("candidates")), fg="green")
 
 
 def save_state(state, file="state.json"):
@@ -81,7 +97,7 @@ def git_exec_getcommit(cmd):
         kci_err(f"git command answer length failed: {lines}")
         sys.exit(1)
     # is it last bisect?: "is the first bad commit"
-    if "is the first bad commit" in str(lines[1]):
+    if any(b"is the first bad commit" in line for line in lines[:2]):
         click.secho(f"git command: {lines}", fg="green")
         # TBD save state somehow?
         sys.exit(0)
@@ -92,26 +108,6 @@ def git_exec_getcommit(cmd):
     return re_commit.group(1)
 
 
-def kcidev_exec(cmd):
-    """
-    Execute a kci-dev and return the return code
-    """
-    process = None
-    click.secho("Executing kci-dev command: " + " " + str(cmd), fg="green")
-    with subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-    ) as process:
-        try:
-            for line in process.stdout:
-                click.echo(line, nl=False)
-            process.wait()
-        except Exception as e:
-            kci_err(f"Error executing kci-dev: {e}")
-            sys.exit(1)
-
-    return process
-
-
 def execute_cmdline(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE):
     try:
         return subprocess.run(cmd, stdout=stdout, stderr=stderr)
@@ -151,7 +147,151 @@ def update_tree(workdir, branch, giturl):
     return repo
 
 
-def bisection_loop(state):
+# Bisection result of a commit by watch status
+WATCH_RESULTS = {0: "good", 1: "bad", 2: "skip"}
+
+
+def trigger_commit(instance, state, commit, label=None, required=True):
+    """
+    Trigger the checkout of commit, return its treeid. Failing to trigger a
+    checkout that is not required is only warned about.
+    """
+    prefix = f"[{label}] " if label else ""
+    resp = send_checkout_full(
+        instance["pipeline"],
+        instance["token"],
+        giturl=state["giturl"],
+        branch=state["branch"],
+        commit=commit,
+        job_filter=state["job_filter"],
+        platform_filter=state["platform_filter"],
+    )
+    if not resp:
+        if not required:
+            kci_warning(f"{prefix}Failed to trigger checkout of {commit}")
+            return None
+        kci_err(f"{prefix}Failed to trigger checkout")
+        sys.exit(1)
+    node = resp.get("node") or {}
+    treeid = node.get("treeid")
+    if not treeid:
+        kci_err(f"{prefix}No treeid returned for the checkout, Maestro failed")
+    return treeid
+
+
+def check_commit(
+    instance, state, commit, label=None, treeid=None, trigger=True, stop=None
+):
+    """
+    Test commit on Maestro, or watch its checkout treeid if already
+    triggered (with trigger False, its checkout is never triggered here).
+    Return a dict with the commit, the treeid of its checkout and its
+    bisection result: good, bad or skip, or None if Maestro failed to test
+    it and it needs to be tested again. The watch is given the stop event.
+    """
+    check = {"commit": commit, "treeid": treeid, "result": None}
+    prefix = f"[{label}] " if label else ""
+    if not check["treeid"] and trigger:
+        check["treeid"] = trigger_commit(instance, state, commit, label)
+    if not check["treeid"]:
+        return check
+    click.secho(f"{prefix}Watching treeid: {check['treeid']}", fg="green")
+    status = maestro_watch_tree(
+        instance["api"],
+        instance["token"],
+        check["treeid"],
+        state["job_filter"],
+        state["test"],
+        label=label,
+        stop=stop,
+    )
+    check["result"] = WATCH_RESULTS.get(status)
+    retry = check["result"] == "bad" or (
+        check["result"] == "good" and state.get("retry_pass")
+    )
+    if retry and state["retry_fail"] > 0:
+        check["result"] = confirm_result(instance, state, check, label, stop)
+    return check
+
+
+def confirm_result(instance, state, check, label=None, stop=None):
+    """
+    Retry the job of the test of a checked commit retry_fail times
+    concurrently, and vote: return the result of the majority of all the
+    runs, or skip if there is none, as the test is flaky on this commit
+    """
+    prefix = f"[{label}] " if label else ""
+    nodes_index = maestro_tree_index(
+        instance["api"], instance["token"], check["treeid"]
+    )
+    tests = [
+        node
+        for node in (nodes_index or {}).values()
+        if node["name"] == state["test"] and node.get("result")
+    ]
+    # retry the job of a run with the result being confirmed
+    expected = "fail" if check["result"] == "bad" else "pass"
+    tests.sort(key=lambda node: node["result"] != expected)
+    job = maestro_node_job(tests[0], nodes_index) if tests else None
+    if not job:
+        kci_warning(f"{prefix}No job found to retry {state['test']}")
+        return check["result"]
+    count = state["retry_fail"]
+    click.secho(
+        f"{prefix}Confirming {check['result']} result, retrying {job['name']} "
+        f"{count} times",
+        fg="green",
+    )
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        responses = list(
+            executor.map(
+                lambda _: send_jobretry(
+                    instance["pipeline"], job["id"], instance["token"]
+                ),
+                range(count),
+            )
+        )
+    count = len([resp for resp in responses if resp])
+    if not count:
+        kci_warning(f"{prefix}Failed to retry {job['name']}")
+        return check["result"]
+    results = maestro_watch_retries(
+        instance["api"],
+        instance["token"],
+        job,
+        state["test"],
+        count,
+        set(nodes_index),
+        label,
+        stop,
+    )
+    passed = list(results.values()).count("pass")
+    failed = list(results.values()).count("fail")
+    click.secho(f"{prefix}Votes: {passed} pass, {failed} fail", fg="green")
+    if passed > failed:
+        return "good"
+    if failed > passed:
+        return "bad"
+    return "skip"
+
+
+def speculate_commits(commit):
+    """
+    Return the commits to test next if commit is good, and if it is bad:
+    the midpoints of the range above it and of the range below it
+    """
+    commits = bisect_range()
+    if commit not in commits:
+        return {}
+    index = commits.index(commit)
+    speculative = {}
+    for result, half in (("good", commits[index + 1 :]), ("bad", commits[:index])):
+        if half:
+            speculative[result] = half[len(half) // 2]
+    return speculative
+
+
+def bisection_loop(instance, state, speculative=False):
     olddir = os.getcwd()
     os.chdir(state["workdir"])
     commit = state["next_commit"]
@@ -159,56 +299,234 @@ def bisection_loop(state):
         click.secho("Bisection error?", fg="green")
         return
     click.secho("Testing commit: " + commit, fg="green")
-    cmd = [
-        "kci-dev",
-        "checkout",
-        "--giturl",
-        state["giturl"],
-        "--branch",
-        state["branch"],
-        "--test",
-        state["test"],
-        "--commit",
+    # commits triggered speculatively by the previous step, with their treeid
+    treeids = state.get("speculative") or {}
+    next_commits = {}
+    if speculative:
+        treeid = treeids.get(commit) or trigger_commit(instance, state, commit)
+        treeids = {commit: treeid}
+        # while commit is tested, test the commits that can come after it
+        next_commits = speculate_commits(commit)
+        for next_commit in next_commits.values():
+            click.secho("Triggering speculatively: " + next_commit, fg="green")
+            treeids[next_commit] = trigger_commit(
+                instance, state, next_commit, required=False
+            )
+    # with speculative, the checkout of commit has already been triggered
+    bisect_result = check_commit(
+        instance,
+        state,
         commit,
-        "--watch",
-    ]
-    # job_filter is array, so we need to add each element as a separate argument
-    for job in state["job_filter"]:
-        cmd.append("--job-filter")
-        cmd.append(job)
-    for platform in state["platform_filter"]:
-        cmd.append("--platform-filter")
-        cmd.append(platform)
-    result = kcidev_exec(cmd)
-    try:
-        testret = result.returncode
-    except Exception as e:
-        kci_err(f"Error executing kci-dev, no returncode: {e}")
-        sys.exit
-    if testret == 0:
-        bisect_result = "good"
-    elif testret == 1:
-        # TBD: Retry failed test to make sure it is not a flaky test
-        bisect_result = "bad"
-    elif testret == 2:
-        # TBD: Retry failed test to make sure it is not a flaky test
-        bisect_result = "skip"
-    elif testret == 3:
+        treeid=treeids.get(commit),
+        trigger=not speculative,
+    )["result"]
+    if bisect_result is None:
         kci_err(f"Maestro failed to execute the test.")
-        # Internal maestro error, retry procesure
+        state["speculative"] = {}
+        os.chdir(olddir)
         return None
-    else:
-        kci_err(
-            f"Unknown or critical return code from kci-dev: {testret}. Try to run last command manually and inspect the output:"
-        )
-        kci_err(f"{' '.join(cmd)}")
-        sys.exit(1)
-    cmd = ["git", "bisect", bisect_result]
+    cmd = ["git", "bisect", bisect_result, commit]
     commitid = git_exec_getcommit(cmd)
     if not commitid:
         kci_err("git bisect failed, commit return is empty")
         sys.exit(1)
     state["history"].append({commit: bisect_result})
+    # Use the commit already triggered for this result, if still in range
+    next_commit = next_commits.get(bisect_result)
+    if next_commit and treeids.get(next_commit) and next_commit in bisect_range():
+        commitid = next_commit
+    state["speculative"] = {commitid: treeids[commitid]} if commitid in treeids else {}
+    state["next_commit"] = commitid
+    os.chdir(olddir)
+    return state
+
+
+def git_refs(pattern):
+    results = execute_cmdline(
+        ["git", "for-each-ref", "--format=%(objectname)", pattern]
+    )
+    return results.stdout.decode().split()
+
+
+def bisect_range():
+    """
+    Return the commits left to test in the bisection range, oldest first.
+    Must be run in the repository being bisected.
+    """
+    bad = git_refs("refs/bisect/bad")[0]
+    goods = git_refs("refs/bisect/good-*")
+    skipped = set(git_refs("refs/bisect/skip-*"))
+    results = execute_cmdline(["git", "rev-list", "--topo-order", bad, "--not"] + goods)
+    return [
+        commit
+        for commit in reversed(results.stdout.decode().split())
+        if commit != bad and commit not in skipped
+    ]
+
+
+def bisect_candidates(count):
+    """
+    Return count commits evenly spaced in the remaining bisection range,
+    oldest first. Must be run in the repository being bisected.
+    """
+    commits = bisect_range()
+    if len(commits) <= count:
+        return commits
+    return [commits[(i + 1) * len(commits) // (count + 1)] for i in range(count)]
+
+
+def bisect_mark(state, results):
+    """
+    Mark commits with their results (by commit, oldest first) with git
+    bisect, return the next commit to test. The range is narrowed down to
+    the newest good commit before the oldest bad one, so results of newer
+    commits are not used.
+    """
+    commitid = None
+    for commit, result in results.items():
+        commitid = git_exec_getcommit(["git", "bisect", result, commit])
+        state["history"].append({commit: result})
+        if result == "bad":
+            break
+    if not commitid:
+        kci_err("git bisect failed, commit return is empty")
+        sys.exit(1)
+    return commitid
+
+
+DASHBOARD_ORIGIN = "maestro"
+DASHBOARD_SEED_JOBS = 8
+# Most commits of a bisection range have no results in the dashboard, so
+# only look up this many, evenly spaced in the range
+DASHBOARD_SEED_MAX = 16
+
+
+def dashboard_commit_result(state, commit):
+    """
+    Return the bisection result of commit from the results of the test
+    already in the dashboard: good or bad if they all agree, else None
+    """
+    statuses = set()
+    try:
+        for kind in ("tests", "boots"):
+            for test in dashboard_stream_commit_results(
+                kind,
+                DASHBOARD_ORIGIN,
+                state["giturl"],
+                state["branch"],
+                commit,
+                None,
+                False,
+                quiet=True,
+            ):
+                path = test.get("path") or ""
+                if path != state["test"] and not path.endswith("." + state["test"]):
+                    continue
+                platform = (test.get("environment_misc") or {}).get("platform")
+                if (
+                    state["platform_filter"]
+                    and platform not in state["platform_filter"]
+                ):
+                    continue
+                statuses.add(test.get("status"))
+            if statuses:
+                break
+    except click.exceptions.Abort:
+        return None
+    if statuses == {"PASS"}:
+        return "good"
+    if statuses == {"FAIL"}:
+        return "bad"
+    return None
+
+
+def dashboard_seed(state):
+    """
+    Look up the results of up to DASHBOARD_SEED_MAX commits of the bisection
+    range in the dashboard concurrently, and narrow the range from them, so
+    that only commits without results are tested. Return the next commit to
+    test, or None if there are no results. Must be run in the repository.
+    """
+    commits = bisect_candidates(DASHBOARD_SEED_MAX)
+    click.secho(
+        f"Looking up dashboard results of {len(commits)} commits...", fg="green"
+    )
+    with ThreadPoolExecutor(max_workers=DASHBOARD_SEED_JOBS) as executor:
+        results = executor.map(
+            lambda commit: dashboard_commit_result(state, commit), commits
+        )
+        known = {commit: result for commit, result in zip(commits, results) if result}
+    for commit, result in known.items():
+        click.secho(f"Dashboard result of {commit}: {result}", fg="green")
+    if not known:
+        return None
+    return bisect_mark(state, known)
+
+
+def multisection_loop(instance, state, parallel, state_file):
+    """
+    Test up to parallel commits of the bisection range concurrently, and
+    narrow the range from their combined results, so that a bisection takes
+    about log(parallel + 1) rounds instead of log(2). The commits in flight
+    are kept in the state, so that an interrupted round can be resumed.
+    """
+    olddir = os.getcwd()
+    os.chdir(state["workdir"])
+    candidates = state.setdefault("candidates", {})
+    if not candidates:
+        for commit in bisect_candidates(parallel):
+            candidates[commit] = {"treeid": None, "result": None}
+        save_state(state, state_file)
+    pending = [
+        commit for commit, check in candidates.items() if check["result"] is None
+    ]
+    for commit in pending:
+        if not candidates[commit]["treeid"]:
+            # saved right away, so that a resumed round watches the checkout
+            treeid = trigger_commit(instance, state, commit, commit[:12])
+            candidates[commit]["treeid"] = treeid
+            save_state(state, state_file)
+    click.secho("Testing commits: " + " ".join(pending), fg="green")
+    maestro_client().set_pool_size(len(pending))
+    # stop the other commits' watches on interrupt, or if one of them fails
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(pending) or 1)
+    try:
+        futures = [
+            executor.submit(
+                check_commit,
+                instance,
+                state,
+                commit,
+                commit[:12],
+                treeid=candidates[commit]["treeid"],
+                trigger=False,
+                stop=stop,
+            )
+            for commit in pending
+        ]
+        for future in as_completed(futures):
+            check = future.result()
+            # a checkout Maestro failed to test is triggered again
+            treeid = check["treeid"] if check["result"] else None
+            candidates[check["commit"]] = {"treeid": treeid, "result": check["result"]}
+            click.secho(
+                f"Commit {check['commit']} (treeid {check['treeid']}): "
+                f"{check['result']}",
+                fg="green",
+            )
+            save_state(state, state_file)
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    results = {commit: check["result"] for commit, check in candidates.items()}
+    if None in results.values():
+        # Maestro failed to execute some tests, test them again
+        os.chdir(olddir)
+        return None
+
+    commitid = bisect_mark(state, results)
+    state["candidates"] = {}
     state["next_commit"] = commitid
     os.chdir(olddir)
     return state
@@ -219,13 +537,38 @@ def bisection_loop(state):
 @click.option("--branch", help="define the repository branch")
 @click.option("--good", help="known good commit")
 @click.option("--bad", help="known bad commit")
-@click.option("--retry-fail", help="retry failed test N times", default=2)
+@click.option(
+    "--retry-fail",
+    help="retry failed test N times concurrently, and use the majority result",
+    default=2,
+)
+@click.option(
+    "--retry-pass",
+    is_flag=True,
+    help="with --retry-fail, retry passed tests as well",
+)
 @click.option("--workdir", help="define the repository origin", default="kcidev-src")
 @click.option("--ignore-state", help="ignore save state", is_flag=True)
 @click.option("--state-file", help="state file", default="state.json")
 @click.option("--job-filter", help="filter the job", multiple=True)
 @click.option("--platform-filter", help="filter the platform", multiple=True)
 @click.option("--test", help="Test expected to fail")
+@click.option(
+    "--parallel",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of commits tested concurrently in each bisection round",
+)
+@click.option(
+    "--speculative",
+    is_flag=True,
+    help="While a commit is tested, trigger the two commits that can be tested next",
+)
+@click.option(
+    "--seed",
+    is_flag=True,
+    help="Use the test results already in the dashboard before testing commits",
+)
 
 # test
 @click.pass_context
@@ -236,17 +579,22 @@ def bisect(
     good,
     bad,
     retry_fail,
+    retry_pass,
     workdir,
     ignore_state,
     state_file,
     job_filter,
     platform_filter,
     test,
+    parallel,
+    speculative,
+    seed,
 ):
     config = ctx.obj.get("CFG")
     instance = ctx.obj.get("INSTANCE")
 
-    state_file = os.path.join(workdir, state_file)
+    # absolute, as the bisection runs in workdir
+    state_file = os.path.abspath(os.path.join(workdir, state_file))
     state = load_state(state_file)
     if state is None or ignore_state:
         state = default_state
@@ -277,6 +625,7 @@ def bisect(
         state["good"] = good
         state["bad"] = bad
         state["retry_fail"] = retry_fail
+        state["retry_pass"] = retry_pass
         state["job_filter"] = job_filter
         state["platform_filter"] = platform_filter
         state["test"] = test
@@ -290,11 +639,19 @@ def bisect(
     if not state["bisect_init"]:
         state["next_commit"] = init_bisect(repo, state)
         state["bisect_init"] = True
+        if seed:
+            olddir = os.getcwd()
+            os.chdir(state["workdir"])
+            state["next_commit"] = dashboard_seed(state) or state["next_commit"]
+            os.chdir(olddir)
         save_state(state, state_file)
 
     while True:
         click.secho("Bisection loop", fg="green")
-        new_state = bisection_loop(state)
+        if parallel > 1:
+            new_state = multisection_loop(config[instance], state, parallel, state_file)
+        else:
+            new_state = bisection_loop(config[instance], state, speculative)
         if new_state is None:
             click.secho("Retry failed test", fg="green")
             continue
@@ -18,10 +18,6 @@ from kcidev.libs.maestro_common import *
 
 def send_checkout_full(baseurl, token, **kwargs):
     url = baseurl + "api/checkout"
-    headers = {
-        "Content-Type": "application/json; charset=utf-8",
-        "Authorization": f"{token}",
-    }
     data = {
         "url": kwargs["giturl"],
         "branch": kwargs["branch"],
@@ -33,7 +29,7 @@ def send_checkout_full(baseurl, token, **kwargs):
     jdata = json.dumps(data)
     maestro_print_api_call(url, data)
     try:
-        response = requests.post(url, headers=headers, data=jdata, timeout=30)
+        response = maestro_client().post(url, token=token, data=jdata)
     except requests.exceptions.RequestException as e:
         kci_err(f"API connection error: {e}")
         return None
@@ -100,9 +96,23 @@ def retrieve_tot_commit(repourl, branch):
     "--test",
     help="Return code based on the test result",
 )
+@click.option(
+    "--events",
+    is_flag=True,
+    help="With --watch, react to node events from the API instead of polling",
+)
 @click.pass_context
 def checkout(
-    ctx, giturl, branch, commit, job_filter, platform_filter, tipoftree, watch, test
+    ctx,
+    giturl,
+    branch,
+    commit,
+    job_filter,
+    platform_filter,
+    tipoftree,
+    watch,
+    test,
+    events,
 ):
     cfg = ctx.obj.get("CFG")
     instance = ctx.obj.get("INSTANCE")
@@ -167,7 +177,7 @@ def checkout(
         if test:
             click.secho(f"Watching for test result: {test}", fg="green")
         # watch for jobs
-        maestro_watch_jobs(apiurl, token, treeid, job_filter, test)
+        maestro_watch_jobs(apiurl, token, treeid, job_filter, test, events)
 
 
 if __name__ == "__main__":
@@ -14,6 +14,22 @@ from kcidev.libs.maestro_common import *
     required=False,
     help="select node_id",
 )
+@click.option(
+    "--subtree",
+    required=False,
+    help="select node_id, and get all the nodes below it",
+)
+@click.option(
+    "--depth",
+    type=click.IntRange(min=1),
+    required=False,
+    help="Number of levels of nodes to get below the --subtree node",
+)
+@click.option(
+    "--flat",
+    is_flag=True,
+    help="Print the --subtree nodes as a list instead of nested under their parent",
+)
 @click.option(
     "--nodes",
     is_flag=True,
@@ -32,11 +48,26 @@ from kcidev.libs.maestro_common import *
     required=False,
     help="Offset of the pagination",
 )
+@click.option(
+    "--all",
+    "all_nodes",
+    is_flag=True,
+    required=False,
+    help="Get all nodes, fetching the pages of --limit nodes from --offset",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of pages (or --subtree nodes) fetched concurrently",
+)
 @click.option(
     "--filter",
     required=False,
     multiple=True,
-    help="Filter nodes by conditions",
+    help="Filter nodes by conditions, e.g. kind=kbuild, result!=pass, "
+    "updated>=2025-01-01, name~regex, name*=substring",
 )
 @click.option(
     "--field",
@@ -44,19 +75,55 @@ from kcidev.libs.maestro_common import *
     multiple=True,
     help="Print only particular field(s) from node data",
 )
+@click.option(
+    "--ndjson",
+    is_flag=True,
+    help="Print one json node per line, as soon as available",
+)
 @click.pass_context
-def maestro_results(ctx, nodeid, nodes, limit, offset, filter, field):
+def maestro_results(
+    ctx,
+    nodeid,
+    subtree,
+    depth,
+    flat,
+    nodes,
+    limit,
+    offset,
+    all_nodes,
+    jobs,
+    filter,
+    field,
+    ndjson,
+):
     config = ctx.obj.get("CFG")
     instance = ctx.obj.get("INSTANCE")
     url = config[instance]["api"]
-    if not nodeid and not nodes:
-        kci_err("--nodes or --nodes needs to be supplied")
+    if not nodeid and not subtree and not nodes:
+        kci_err("--nodeid, --subtree or --nodes needs to be supplied")
         sys.exit(-1)
+    if subtree and (nodeid or nodes or filter):
+        kci_err("--subtree can't be used with --nodeid, --nodes or --filter")
+        sys.exit(errno.EINVAL)
+    try:
+        params = maestro_filter_params(filter)
+    except ValueError as ex:
+        kci_err(ex)
+        sys.exit(errno.EINVAL)
+    if subtree:
+        results = maestro_get_subtree(url, subtree, depth, jobs)
+        if not flat and not ndjson:
+            kci_msg(
+                json.dumps(maestro_nest_nodes(results, field), sort_keys=True, indent=4)
+            )
+            return
     if nodeid:
         results = maestro_get_node(url, nodeid)
-    if nodes:
-        results = maestro_get_nodes(url, limit, offset, filter)
-    maestro_print_nodes(results, field)
+    if nodes and all_nodes:
+        results = maestro_iter_nodes(url, limit, offset, params, jobs)
+    elif nodes:
+        results = maestro_get_nodes(url, limit, offset, params)
+    maestro_print_nodes(results, field, ndjson)
 
 
 if __name__ == "__main__":
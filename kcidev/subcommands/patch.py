@@ -23,7 +23,9 @@ def send_build(url, patch, branch, treeurl, token):
         "testname": "example",
     }
     maestro_print_api_call(url, values)
-    response = requests.post(url, headers=headers, files={"patch": patch}, data=values)
+    response = maestro_client().post(
+        url, headers=headers, files={"patch": patch}, data=values
+    )
     click.secho(response.status_code, fg="green")
     click.secho(response.json(), fg="green")
 
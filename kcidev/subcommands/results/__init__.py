@@ -1,16 +1,22 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import json
 from functools import wraps
 
 import click
 
+from kcidev.libs.common import *
 from kcidev.libs.dashboard import (
     dashboard_fetch_boots,
     dashboard_fetch_build,
     dashboard_fetch_builds,
+    dashboard_fetch_commit_results,
     dashboard_fetch_summary,
     dashboard_fetch_test,
     dashboard_fetch_tests,
+    dashboard_set_cache,
+    dashboard_set_session_options,
+    dashboard_stream_commit_results,
 )
 from kcidev.libs.git_repo import set_giturl_branch_commit
 from kcidev.subcommands.results.hardware import hardware
@@ -19,14 +25,18 @@ from kcidev.subcommands.results.options import (
     common_options,
     results_display_options,
     single_build_and_test_options,
+    streaming_options,
 )
 from kcidev.subcommands.results.parser import (
+    builds_json,
     cmd_builds,
     cmd_list_trees,
     cmd_single_build,
     cmd_single_test,
     cmd_summary,
     cmd_tests,
+    summary_json,
+    tests_json,
 )
 
 
@@ -34,9 +44,16 @@ from kcidev.subcommands.results.parser import (
     help="[Experimental] Get results from the dashboard",
     commands={"hardware": hardware},
 )
-def results():
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Always fetch results from the dashboard, bypassing the local cache",
+)
+@click.pass_context
+def results(ctx, no_cache):
     """Commands related to results."""
-    pass
+    dashboard_set_session_options(ctx.obj.get("CFG"), ctx.obj.get("INSTANCE"))
+    dashboard_set_cache(not no_cache)
 
 
 @results.command()
@@ -77,6 +94,8 @@ def builds(
     status,
     filter,
     count,
+    jobs,
+    ndjson,
     use_json,
 ):
     """Display build results."""
@@ -84,12 +103,15 @@ def builds(
         origin, giturl, branch, commit, latest, git_folder
     )
     data = dashboard_fetch_builds(origin, giturl, branch, commit, arch, use_json)
-    cmd_builds(data, commit, download_logs, status, count, use_json)
+    cmd_builds(
+        data, commit, download_logs, status, count, use_json, jobs, ndjson=ndjson
+    )
 
 
 @results.command()
 @common_options
 @builds_and_tests_options
+@streaming_options
 def boots(
     origin,
     git_folder,
@@ -102,19 +124,39 @@ def boots(
     status,
     filter,
     count,
+    jobs,
+    ndjson,
     use_json,
+    stream,
 ):
     """Display boot results."""
     giturl, branch, commit = set_giturl_branch_commit(
         origin, giturl, branch, commit, latest, git_folder
     )
-    data = dashboard_fetch_boots(origin, giturl, branch, commit, arch, use_json)
-    cmd_tests(data["boots"], commit, download_logs, status, filter, count, use_json)
+    if stream:
+        data = dashboard_stream_commit_results(
+            "boots", origin, giturl, branch, commit, arch, use_json
+        )
+    else:
+        data = dashboard_fetch_boots(origin, giturl, branch, commit, arch, use_json)
+        data = data["boots"]
+    cmd_tests(
+        data,
+        commit,
+        download_logs,
+        status,
+        filter,
+        count,
+        use_json,
+        jobs,
+        ndjson=ndjson,
+    )
 
 
 @results.command()
 @common_options
 @builds_and_tests_options
+@streaming_options
 def tests(
     origin,
     git_folder,
@@ -127,14 +169,127 @@ def tests(
     status,
     filter,
     count,
+    jobs,
+    ndjson,
     use_json,
+    stream,
 ):
     """Display test results."""
     giturl, branch, commit = set_giturl_branch_commit(
         origin, giturl, branch, commit, latest, git_folder
     )
-    data = dashboard_fetch_tests(origin, giturl, branch, commit, arch, use_json)
-    cmd_tests(data["tests"], commit, download_logs, status, filter, count, use_json)
+    if stream:
+        data = dashboard_stream_commit_results(
+            "tests", origin, giturl, branch, commit, arch, use_json
+        )
+    else:
+        data = dashboard_fetch_tests(origin, giturl, branch, commit, arch, use_json)
+        data = data["tests"]
+    cmd_tests(
+        data,
+        commit,
+        download_logs,
+        status,
+        filter,
+        count,
+        use_json,
+        jobs,
+        ndjson=ndjson,
+    )
+
+
+@results.command(name="all")
+@common_options
+@builds_and_tests_options
+@click.option(
+    "--include",
+    default="summary,builds,boots,tests",
+    show_default=True,
+    help="Comma separated list of results to display",
+)
+def all_results(
+    origin,
+    git_folder,
+    giturl,
+    branch,
+    commit,
+    latest,
+    arch,
+    download_logs,
+    status,
+    filter,
+    count,
+    jobs,
+    ndjson,
+    use_json,
+    include,
+):
+    """Display summary, build, boot and test results at once."""
+    kinds = [kind.strip() for kind in include.split(",") if kind.strip()]
+    for kind in kinds:
+        if kind not in ["summary", "builds", "boots", "tests"]:
+            kci_err(f"Unknown results kind: {kind}")
+            raise click.Abort()
+    if not kinds:
+        kci_err("Nothing to display, --include is empty")
+        raise click.Abort()
+    giturl, branch, commit = set_giturl_branch_commit(
+        origin, giturl, branch, commit, latest, git_folder
+    )
+    data = dashboard_fetch_commit_results(
+        origin, giturl, branch, commit, arch, use_json or ndjson, kinds
+    )
+    # Render in a fixed order, regardless of the order given in --include
+    kinds = [kind for kind in ["summary", "builds", "boots", "tests"] if kind in data]
+    if use_json and not ndjson:
+        # a single json document, with the results by kind
+        results = {}
+        for kind in kinds:
+            if kind == "summary":
+                results[kind] = summary_json(data[kind])
+            elif kind == "builds":
+                results[kind] = builds_json(
+                    data[kind], commit, download_logs, status, count, jobs
+                )
+            else:
+                if filter:
+                    filter.seek(0)
+                results[kind] = tests_json(
+                    data[kind][kind], commit, download_logs, status, filter, count, jobs
+                )
+        kci_msg(json.dumps(results))
+        return
+    use_json = ndjson
+    for kind in kinds:
+        if not use_json:
+            kci_msg_cyan_nonl(f"{kind}:\n")
+        if kind == "summary":
+            cmd_summary(data[kind], use_json)
+        elif kind == "builds":
+            cmd_builds(
+                data[kind],
+                commit,
+                download_logs,
+                status,
+                count,
+                use_json,
+                jobs,
+                ndjson=ndjson,
+            )
+        else:
+            if filter:
+                filter.seek(0)
+            cmd_tests(
+                data[kind][kind],
+                commit,
+                download_logs,
+                status,
+                filter,
+                count,
+                use_json,
+                jobs,
+                ndjson=ndjson,
+            )
 
 
 @results.command()
@@ -68,6 +68,31 @@ def builds_and_tests_options(func):
     @click.option(
         "--count", is_flag=True, help="Display the number of matching results"
     )
+    @click.option(
+        "--ndjson",
+        is_flag=True,
+        help="Displays results as json, one result per line as soon as available",
+    )
+    @click.option(
+        "--jobs",
+        type=click.IntRange(min=1),
+        default=4,
+        show_default=True,
+        help="Number of logs downloaded in parallel with --download-logs",
+    )
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def streaming_options(func):
+    @click.option(
+        "--stream",
+        is_flag=True,
+        help="Decode and display results while they are being downloaded",
+    )
     @wraps(func)
     def wrapper(*args, **kwargs):
         return func(*args, **kwargs)
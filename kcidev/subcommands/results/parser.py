@@ -1,12 +1,14 @@
+import fnmatch
 import gzip
 import json
+import re
 
 import requests
 import yaml
 
 from kcidev.libs.common import *
 from kcidev.libs.dashboard import dashboard_fetch_tree_list
-from kcidev.libs.files import download_logs_to_file
+from kcidev.libs.files import download_logs_ordered, download_logs_to_file
 
 
 def print_summary(type, n_pass, n_fail, n_inconclusive):
@@ -102,14 +104,7 @@ def cmd_summary(data, use_json):
     inconclusive_tests, pass_tests, fail_tests = get_command_summary(tests)
 
     if use_json:
-        builds_json = create_summary_json(pass_builds, fail_builds, inconclusive_builds)
-        boots_json = create_summary_json(pass_boots, fail_boots, inconclusive_boots)
-        tests_json = create_summary_json(pass_tests, fail_tests, inconclusive_tests)
-        kci_msg(
-            json.dumps(
-                {"builds": builds_json, "boots": boots_json, "tests": tests_json}
-            )
-        )
+        kci_msg(json.dumps(summary_json(data)))
     else:
         kci_msg("pass/fail/inconclusive")
         print_summary("builds", pass_builds, fail_builds, inconclusive_builds)
@@ -117,6 +112,15 @@ def cmd_summary(data, use_json):
         print_summary("tests", pass_tests, fail_tests, inconclusive_tests)
 
 
+def summary_json(data):
+    summary = data["summary"]
+    results = {}
+    for kind in ["builds", "boots", "tests"]:
+        inconclusive, passed, failed = get_command_summary(summary[kind]["status"])
+        results[kind] = create_summary_json(passed, failed, inconclusive)
+    return results
+
+
 def get_command_summary(command_data):
     inconclusive_cmd = sum_inconclusive_results(command_data)
     pass_cmd = command_data["PASS"] if "PASS" in command_data.keys() else 0
@@ -136,68 +140,99 @@ def cmd_list_trees(origin, use_json):
         kci_msg(f"  latest: {t['start_time']}")
 
 
-def cmd_builds(data, commit, download_logs, status, count, use_json):
-    if status == "inconclusive" and use_json:
-        kci_msg('{"message":"No information about inconclusive builds."}')
-        return
-    elif status == "inconclusive":
-        kci_msg("No information about inconclusive builds.")
-        return
-    filtered_builds = 0
-    builds = []
-    for build in data["builds"]:
+def select_builds(builds, status):
+    for build in builds:
         if not status == "all":
             if build["status"] != "FAIL" and status == "fail":
                 continue
 
             if build["status"] != "PASS" and status == "pass":
                 continue
+        yield build
+
+
+def iter_builds(data, commit, download_logs, status, jobs):
+    """Yield the builds selected by status, with their log path"""
+
+    def build_log(build):
+        log_file = f"{build['config_name']}-{build['architecture']}-{build['compiler']}-{commit}.log"
+        return build["log_url"], log_file
 
-        log_path = build["log_url"]
-        if download_logs:
-            try:
-                log_file = f"{build['config_name']}-{build['architecture']}-{build['compiler']}-{commit}.log"
-                log_path = download_logs_to_file(build["log_url"], log_file)
-            except:
-                kci_err(f"Failed to fetch log {build['log_url']}.")
-                pass
+    selected = select_builds(data["builds"], status)
+    if download_logs:
+        return download_logs_ordered(selected, build_log, jobs)
+    return ((build, build["log_url"]) for build in selected)
+
+
+def builds_json(data, commit, download_logs, status, count, jobs):
+    """Return the json output of cmd_builds"""
+    if status == "inconclusive":
+        return {"message": "No information about inconclusive builds."}
+    results = iter_builds(data, commit, download_logs, status, jobs)
+    if count:
+        return {"count": sum(1 for _ in results)}
+    return [create_build_json(build, log_path) for build, log_path in results]
+
+
+def cmd_builds(
+    data, commit, download_logs, status, count, use_json, jobs, ndjson=False
+):
+    if use_json and not ndjson:
+        builds = builds_json(data, commit, download_logs, status, count, jobs)
+        # messages and counts are written without spaces
+        separators = (",", ":") if isinstance(builds, dict) else None
+        kci_msg(json.dumps(builds, separators=separators))
+        return
+    # ndjson is json output, written one record per line as results come
+    if status == "inconclusive" and ndjson:
+        kci_msg('{"message":"No information about inconclusive builds."}')
+        return
+    elif status == "inconclusive":
+        kci_msg("No information about inconclusive builds.")
+        return
+    filtered_builds = 0
+    results = iter_builds(data, commit, download_logs, status, jobs)
+    for build, log_path in results:
         if count:
             filtered_builds += 1
-        elif use_json:
-            builds.append(create_build_json(build, log_path))
+        elif ndjson:
+            kci_msg(json.dumps(create_build_json(build, log_path)))
         else:
             print_build(build, log_path)
-    if count and use_json:
+    if count and ndjson:
         kci_msg(f'{{"count":{filtered_builds}}}')
     elif count:
         kci_msg(filtered_builds)
-    elif use_json:
-        kci_msg(json.dumps(builds))
+    kci_flush()
+
+
+def format_status(status):
+    if status == "PASS":
+        return kci_style("PASS", "green")
+    elif status == "FAIL":
+        return kci_style("FAIL", "red")
+    return kci_style(f"INCONCLUSIVE (status: {status})", "bright_yellow")
+
+
+def format_build(build, log_path):
+    """Format a build as a single (possibly colored) string"""
+    config = kci_style(build["config_name"], "cyan")
+    arch = kci_style(build["architecture"], "cyan")
+    compiler = kci_style(build["compiler"], "cyan")
+    lines = [
+        f"- config:{config} arch: {arch} compiler: {compiler}",
+        f"  status:{format_status(build['status'])}",
+        f"  config_url: {build['config_url']}",
+        f"  log: {log_path}",
+        f"  id: {build['id']}",
+        f"  dashboard: https://dashboard.kernelci.org/build/{build['id']}",
+        "",
+    ]
+    return "\n".join(lines)
 
 
 def print_build(build, log_path):
-    kci_msg_nonl("- config:")
-    kci_msg_cyan_nonl(build["config_name"])
-    kci_msg_nonl(" arch: ")
-    kci_msg_cyan_nonl(build["architecture"])
-    kci_msg_nonl(" compiler: ")
-    kci_msg_cyan_nonl(build["compiler"])
-    kci_msg("")
-
-    kci_msg_nonl("  status:")
-    if build["status"] == "PASS":
-        kci_msg_green_nonl("PASS")
-    elif build["status"] == "FAIL":
-        kci_msg_red_nonl("FAIL")
-    else:
-        kci_msg_yellow_nonl(f"INCONCLUSIVE (status: {build['status']})")
-    kci_msg("")
-
-    kci_msg(f"  config_url: {build['config_url']}")
-    kci_msg(f"  log: {log_path}")
-    kci_msg(f"  id: {build['id']}")
-    kci_msg(f"  dashboard: https://dashboard.kernelci.org/build/{build['id']}")
-    kci_msg("")
+    kci_msg_buffered(format_build(build, log_path))
 
 
 def filter_out_by_status(status, filter):
@@ -219,15 +254,96 @@ def filter_out_by_status(status, filter):
     return True
 
 
+GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+class NameMatcher:
+    """
+    Match names against a filter list, compiled once into a set of exact
+    names and a single regex for the "glob:" and "re:" pattern entries.
+    Other entries only match exactly, e.g. parameterized test paths "foo[1]"
+    """
+
+    def __init__(self, entries):
+        self.names = set()
+        patterns = []
+        for entry in entries or []:
+            entry = str(entry)
+            if entry.startswith("re:"):
+                patterns.append(entry[3:])
+            elif entry.startswith("glob:"):
+                patterns.append(fnmatch.translate(entry[5:]))
+            else:
+                self.names.add(entry)
+        self.pattern = None
+        if patterns:
+            self.pattern = re.compile("|".join(f"(?:{p})" for p in patterns))
+
+    def match(self, name):
+        if name in self.names:
+            return True
+        return bool(self.pattern and self.pattern.fullmatch(name))
+
+
+class TestPathMatcher(NameMatcher):
+    """
+    Same as NameMatcher, with "glob:" entries ending in ".*" (e.g.
+    "glob:kselftest.*") stored in a prefix trie over the dotted test path
+    components
+    """
+
+    def __init__(self, entries):
+        self.prefixes = {}
+        others = []
+        for entry in entries or []:
+            entry = str(entry)
+            prefix = entry[5:-2]
+            if (
+                entry.startswith("glob:")
+                and entry.endswith(".*")
+                and prefix
+                and not GLOB_CHARS.search(prefix)
+            ):
+                node = self.prefixes
+                for part in prefix.split("."):
+                    node = node.setdefault(part, {})
+                node[None] = True
+            else:
+                others.append(entry)
+        super().__init__(others)
+
+    def match(self, path):
+        if super().match(path):
+            return True
+        node = self.prefixes
+        parts = path.split(".")
+        # the prefix only matches paths below it, not the prefix itself
+        for part in parts[:-1]:
+            node = node.get(part)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+
+def compile_filter(filter_data):
+    """Compile the hardware and test lists of a filter file"""
+    return {
+        "hardware": NameMatcher(filter_data.get("hardware")),
+        "test": TestPathMatcher(filter_data.get("test")),
+    }
+
+
 def filter_out_by_hardware(test, filter_data):
-    # Check if the hardware name is in the list
-    hardware_list = filter_data["hardware"]
-    if test["environment_misc"]["platform"] in hardware_list:
+    # Check if the hardware name or any of its compatibles is in the list
+    hardware = filter_data["hardware"]
+    if hardware.match(test["environment_misc"]["platform"]):
         return False
 
     if test["environment_compatible"]:
         for compatible in test["environment_compatible"]:
-            if compatible in hardware_list:
+            if hardware.match(compatible):
                 return False
 
     return True
@@ -235,18 +351,14 @@ def filter_out_by_hardware(test, filter_data):
 
 def filter_out_by_test(test, filter_data):
     # Check if the test name is in the list
-    test_list = filter_data["test"]
-    if test["path"] in test_list:
+    if filter_data["test"].match(test["path"]):
         return False
 
     return True
 
 
-def cmd_tests(data, commit, download_logs, status_filter, filter, count, use_json):
-    filter_data = yaml.safe_load(filter) if filter else None
-    filtered_tests = 0
-    tests = []
-    for test in data:
+def select_tests(tests, status_filter, filter_data):
+    for test in tests:
         if filter_out_by_status(test["status"], status_filter):
             continue
 
@@ -255,71 +367,105 @@ def cmd_tests(data, commit, download_logs, status_filter, filter, count, use_jso
 
         if filter_data and filter_out_by_test(test, filter_data):
             continue
+        yield test
+
+
+def iter_tests(data, commit, download_logs, status_filter, filter, jobs):
+    """Yield the tests selected by status and filter, with their log path"""
+    filter_data = yaml.safe_load(filter) if filter else None
+    # an empty filter file filters nothing
+    filter_data = compile_filter(filter_data) if filter_data else None
+
+    def test_log(test):
+        platform = (
+            test["environment_misc"]["platform"]
+            if "environment_misc" in test
+            else "(Unknown platform)"
+        )
+        log_file = f"{platform}__{test['path']}__{test['config']}-{test['architecture']}-{test['compiler']}-{commit}.log"
+        return test["log_url"], log_file
 
-        log_path = test["log_url"]
-        if download_logs:
-            platform = (
-                test["environment_misc"]["platform"]
-                if "environment_misc" in test
-                else "(Unknown platform)"
-            )
-            log_file = f"{platform}__{test['path']}__{test['config']}-{test['architecture']}-{test['compiler']}-{commit}.log"
-            log_path = download_logs_to_file(test["log_url"], log_file)
+    selected = select_tests(data, status_filter, filter_data)
+    if download_logs:
+        return download_logs_ordered(selected, test_log, jobs)
+    return ((test, test["log_url"]) for test in selected)
+
+
+def tests_json(data, commit, download_logs, status_filter, filter, count, jobs):
+    """Return the json output of cmd_tests"""
+    results = iter_tests(data, commit, download_logs, status_filter, filter, jobs)
+    if count:
+        return {"count": sum(1 for _ in results)}
+    return [create_test_json(test, log_path) for test, log_path in results]
+
+
+def cmd_tests(
+    data,
+    commit,
+    download_logs,
+    status_filter,
+    filter,
+    count,
+    use_json,
+    jobs,
+    ndjson=False,
+):
+    if use_json and not ndjson:
+        tests = tests_json(
+            data, commit, download_logs, status_filter, filter, count, jobs
+        )
+        separators = (",", ":") if isinstance(tests, dict) else None
+        kci_msg(json.dumps(tests, separators=separators))
+        return
+    filtered_tests = 0
+    results = iter_tests(data, commit, download_logs, status_filter, filter, jobs)
+    for test, log_path in results:
         if count:
             filtered_tests += 1
-        elif use_json:
-            tests.append(create_test_json(test, log_path))
+        elif ndjson:
+            kci_msg(json.dumps(create_test_json(test, log_path)))
         else:
             print_test(test, log_path)
-    if count and use_json:
+    if count and ndjson:
         kci_msg(f'{{"count":{filtered_tests}}}')
     elif count:
         kci_msg(filtered_tests)
-    elif use_json:
-        kci_msg(json.dumps(tests))
-
-
-def print_test(test, log_path):
-    kci_msg_nonl("- test path: ")
-    kci_msg_cyan_nonl(test["path"])
-    kci_msg("")
+    kci_flush()
 
-    kci_msg_nonl("  hardware: ")
-    kci_msg_cyan_nonl(test["environment_misc"]["platform"])
-    kci_msg("")
 
+def format_test(test, log_path):
+    """Format a test as a single (possibly colored) string"""
+    lines = [
+        f"- test path: {kci_style(test['path'], 'cyan')}",
+        f"  hardware: {kci_style(test['environment_misc']['platform'], 'cyan')}",
+    ]
     if test["environment_compatible"]:
-        kci_msg_nonl("  compatibles: ")
-        kci_msg_cyan_nonl(" | ".join(test["environment_compatible"]))
-        kci_msg("")
+        compatibles = " | ".join(test["environment_compatible"])
+        lines.append(f"  compatibles: {kci_style(compatibles, 'cyan')}")
 
-    kci_msg_nonl("  config: ")
     if "config" in test:
-        kci_msg_cyan_nonl(test["config"])
+        config = test["config"]
     elif "config_name" in test:
-        kci_msg_cyan_nonl(test["config_name"])
+        config = test["config_name"]
     else:
-        kci_msg_cyan_nonl("No config available")
-    kci_msg_nonl(" arch: ")
-    kci_msg_cyan_nonl(test["architecture"])
-    kci_msg_nonl(" compiler: ")
-    kci_msg_cyan_nonl(test["compiler"])
-    kci_msg("")
-
-    kci_msg_nonl("  status:")
-    if test["status"] == "PASS":
-        kci_msg_green_nonl("PASS")
-    elif test["status"] == "FAIL":
-        kci_msg_red_nonl("FAIL")
-    else:
-        kci_msg_yellow_nonl(f"INCONCLUSIVE (status: {test['status']})")
-    kci_msg("")
-
-    kci_msg(f"  log: {log_path}")
-    kci_msg(f"  start time: {test['start_time']}")
-    kci_msg(f"  id: {test['id']}")
-    kci_msg(f"  dashboard: https://dashboard.kernelci.org/test/{test['id']}")
-    kci_msg("")
+        config = "No config available"
+    config = kci_style(config, "cyan")
+    arch = kci_style(test["architecture"], "cyan")
+    compiler = kci_style(test["compiler"], "cyan")
+    lines += [
+        f"  config: {config} arch: {arch} compiler: {compiler}",
+        f"  status:{format_status(test['status'])}",
+        f"  log: {log_path}",
+        f"  start time: {test['start_time']}",
+        f"  id: {test['id']}",
+        f"  dashboard: https://dashboard.kernelci.org/test/{test['id']}",
+        "",
+    ]
+    return "\n".join(lines)
+
+
+def print_test(test, log_path):
+    kci_msg_buffered(format_test(test, log_path))
 
 
 def cmd_single_test(test, download_logs, use_json):
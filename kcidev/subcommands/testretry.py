@@ -13,15 +13,11 @@ from kcidev.libs.maestro_common import *
 
 def send_jobretry(baseurl, jobid, token):
     url = baseurl + "api/jobretry"
-    headers = {
-        "Content-Type": "application/json; charset=utf-8",
-        "Authorization": f"{token}",
-    }
     data = {"nodeid": jobid}
     jdata = json.dumps(data)
     maestro_print_api_call(url, data)
     try:
-        response = requests.post(url, headers=headers, data=jdata)
+        response = maestro_client().post(url, token=token, data=jdata)
     except requests.exceptions.RequestException as e:
         kci_err(f"API connection error: {e}")
         return
@@ -7,11 +7,31 @@ from kcidev.libs.common import *
 from kcidev.libs.maestro_common import *
 
 
+def read_ids_file(ids_file):
+    """Read node ids from a file, one per line, ignoring comments"""
+    ids = []
+    for line in ids_file:
+        line = line.split("#", 1)[0].strip()
+        if line:
+            ids.append(line)
+    return ids
+
+
 @click.command(help="Watch completion of a test job")
 @click.option(
     "--nodeid",
-    help="define the node id of the job to watch for",
-    required=True,
+    help="define the node id of the job to watch for, can be repeated",
+    multiple=True,
+)
+@click.option(
+    "--treeid",
+    help="define the treeid to watch for, can be repeated",
+    multiple=True,
+)
+@click.option(
+    "--nodeid-file",
+    type=click.File("r"),
+    help="File with node ids to watch for, one per line",
 )
 @click.option(
     "--job-filter",
@@ -22,19 +42,51 @@ from kcidev.libs.maestro_common import *
     "--test",
     help="Return 0 if the test name supplied passed, 1 otherwise",
 )
+@click.option(
+    "--events",
+    is_flag=True,
+    help="React to node events from the API instead of polling at fixed intervals",
+)
 @click.pass_context
-def watch(ctx, nodeid, job_filter, test):
+def watch(ctx, nodeid, treeid, nodeid_file, job_filter, test, events):
     cfg = ctx.obj.get("CFG")
     instance = ctx.obj.get("INSTANCE")
     url = cfg[instance]["pipeline"]
     apiurl = cfg[instance]["api"]
     token = cfg[instance]["token"]
 
-    node = maestro_get_node(apiurl, nodeid)
-    if not node:
-        kci_err(f"node id {nodeid} not found.")
-        sys.exit(errno.ENOENT)
-    maestro_watch_jobs(apiurl, token, node["treeid"], job_filter, test)
+    nodeids = list(nodeid)
+    if nodeid_file:
+        nodeids += read_ids_file(nodeid_file)
+    if not nodeids and not treeid:
+        kci_err("--nodeid, --treeid or --nodeid-file needs to be supplied")
+        sys.exit(errno.EINVAL)
+
+    treeids = list(treeid)
+    for nodeid in nodeids:
+        node = maestro_get_node(apiurl, nodeid)
+        if not node:
+            kci_err(f"node id {nodeid} not found.")
+            sys.exit(errno.ENOENT)
+        if node["treeid"] not in treeids:
+            treeids.append(node["treeid"])
+
+    if len(treeids) == 1:
+        maestro_watch_jobs(apiurl, token, treeids[0], job_filter, test, events)
+        return
+
+    statuses = maestro_watch_trees(apiurl, token, treeids, job_filter, test, events)
+    for treeid, status in statuses.items():
+        if status is None or status == 0:
+            kci_msg(f"{treeid}: {kci_style('PASS', 'green')}")
+        elif status == 1:
+            kci_msg(f"{treeid}: {kci_style('FAIL', 'red')}")
+        else:
+            kci_msg(f"{treeid}: {kci_style('ERROR', 'bright_yellow')}")
+    # exit with the worst status of all trees
+    worst = max(status or 0 for status in statuses.values())
+    if test or worst:
+        sys.exit(worst)
 
 
 if __name__ == "__main__":
@@ -85,6 +85,17 @@ def test_kcidev_results_help(kcidev_config):
     assert result.returncode == 0
 
 
+def test_kcidev_results_all_help():
+    command = ["poetry", "run", "kci-dev", "results", "all", "--help"]
+    result = run(command, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+    print("returncode: " + str(result.returncode))
+    print("#### stdout ####")
+    print(result.stdout)
+    print("#### stderr ####")
+    print(result.stderr)
+    assert result.returncode == 0
+
+
 def test_kcidev_testretry_help(kcidev_config):
     command = [
         "poetry",
@@ -198,3 +209,1143 @@ def test_main():
 def test_clean():
     # clean enviroment
     shutil.rmtree("my-new-repo/")
+
+
+def test_dashboard_cache(tmp_path, monkeypatch):
+    from kcidev.libs import dashboard
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    url = "https://dashboard.example/api/tree/abc/tests?origin=maestro"
+    assert dashboard.dashboard_cache_load(url) is None
+
+    dashboard.dashboard_cache_store(url, b'{"tests": []}', '"etag"', 60)
+    meta = dashboard.dashboard_cache_load(url)
+    assert meta["etag"] == '"etag"'
+    assert dashboard.dashboard_cache_fresh(meta)
+    assert dashboard.dashboard_cache_data(meta) == {"tests": []}
+
+
+def test_dashboard_commit_ttl(tmp_path, monkeypatch):
+    import json
+    from datetime import datetime, timedelta, timezone
+
+    import click
+
+    from kcidev.libs import dashboard
+
+    now = datetime.now(timezone.utc)
+    recent = now.isoformat()
+    old = (now - timedelta(days=90)).isoformat().replace("+00:00", "Z")
+    trees = [
+        {
+            "git_repository_url": "https://git.example/linux.git",
+            "git_repository_branch": "master",
+            "git_commit_hash": "head",
+            "start_time": recent,
+        }
+    ]
+    tree_list = lambda *args, **kwargs: trees
+    monkeypatch.setattr(dashboard, "dashboard_fetch_tree_list", tree_list)
+    latest = dashboard.DASHBOARD_CACHE_TTL_LATEST
+    long = dashboard.DASHBOARD_CACHE_TTL_OLD
+
+    def ttl(commit, data):
+        giturl = "https://git.example/linux.git"
+        return dashboard.dashboard_commit_ttl("maestro", giturl, "master", commit)(data)
+
+    # an old commit of a tree checked out recently is kept for long
+    assert ttl("old", {"builds": [{"start_time": old}]}) == long
+    assert (
+        ttl("old", {"tests": [{"start_time": old}, {"start_time": recent}]}) == latest
+    )
+    assert ttl("old", {"tests": []}) == latest
+    summary = {kind: {"status": {"PASS": 1}} for kind in ["builds", "boots", "tests"]}
+    assert ttl("old", {"summary": summary}) == long
+    assert ttl("head", {"summary": summary}) == latest
+
+    def unreachable(*args, **kwargs):
+        assert kwargs["quiet"]
+        raise click.exceptions.Abort()
+
+    monkeypatch.setattr(dashboard, "dashboard_fetch_tree_list", unreachable)
+    assert ttl("old", {"summary": summary}) == latest
+
+    # a fresh cached response is served without any request
+    body = json.dumps({"builds": [{"id": "b", "start_time": old}]}).encode()
+
+    class Response:
+        status_code = 200
+        headers = {"ETag": '"e"'}
+        content = body
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return json.loads(self.content)
+
+    requests = []
+
+    class Session:
+        def get(self, url, headers, timeout):
+            requests.append(url)
+            return Response()
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(dashboard, "dashboard_session", lambda: Session())
+    for _ in range(2):
+        builds = dashboard.dashboard_fetch_builds(
+            "maestro", "https://git.example/linux.git", "master", "old", None, False
+        )
+        assert builds["builds"][0]["id"] == "b"
+    assert len(requests) == 1
+    assert "tree/old/builds" in requests[0]
+
+
+def test_results_all(monkeypatch):
+    import json
+
+    from click.testing import CliRunner
+
+    import kcidev.subcommands.results as results
+    from kcidev.libs import dashboard
+
+    build = {
+        "id": "b1",
+        "config_name": "defconfig",
+        "config_url": "config",
+        "architecture": "arm64",
+        "compiler": "gcc",
+        "log_url": "log",
+        "status": "FAIL",
+    }
+    test = {
+        "id": "t1",
+        "path": "baseline.login",
+        "status": "PASS",
+        "environment_misc": {"platform": "rock2"},
+        "environment_compatible": [],
+        "config": "defconfig",
+        "architecture": "arm64",
+        "compiler": "gcc",
+        "log_url": "log",
+        "start_time": "2025-01-01T00:00:00",
+    }
+    status = {"status": {"PASS": 2, "FAIL": 1}}
+    responses = {
+        "summary": {"summary": {kind: status for kind in ["builds", "boots", "tests"]}},
+        "builds": {"builds": [build]},
+        "boots": {"boots": [test]},
+        "tests": {"tests": [test]},
+    }
+    fetched = []
+
+    def fetcher(kind):
+        def fetch(origin, giturl, branch, commit, arch, use_json):
+            fetched.append(kind)
+            return responses[kind]
+
+        return fetch
+
+    for kind in responses:
+        monkeypatch.setattr(dashboard, f"dashboard_fetch_{kind}", fetcher(kind))
+    data = dashboard.dashboard_fetch_commit_results(
+        "maestro", "url", "master", "abc", None, False, ["tests", "builds"]
+    )
+    assert data == {"tests": responses["tests"], "builds": responses["builds"]}
+    assert sorted(fetched) == ["builds", "tests"]
+
+    monkeypatch.setattr(
+        results,
+        "dashboard_fetch_commit_results",
+        dashboard.dashboard_fetch_commit_results,
+    )
+    monkeypatch.setattr(results, "set_giturl_branch_commit", lambda *args: args[1:4])
+    args = ["all", "--giturl", "url", "--branch", "master", "--commit", "abc"]
+
+    def run(*options):
+        fetched.clear()
+        return CliRunner().invoke(results.results, args + list(options), obj={})
+
+    # results are displayed in a fixed order, whatever the --include order
+    result = run("--include", "tests,summary,builds")
+    assert result.exit_code == 0
+    headers = [line for line in result.output.splitlines() if line.endswith(":")]
+    assert headers == ["summary:", "builds:", "tests:"]
+    assert sorted(fetched) == ["builds", "summary", "tests"]
+
+    result = run("--json")
+    assert result.exit_code == 0
+    output = json.loads(result.output)
+    assert list(output) == ["summary", "builds", "boots", "tests"]
+    assert output["summary"]["builds"] == {"pass": 2, "fail": 1, "inconclusive": 0}
+    assert output["builds"][0]["id"] == "b1"
+    assert output["tests"][0]["test_path"] == "baseline.login"
+
+    result = run("--json", "--count", "--include", "boots,builds")
+    assert json.loads(result.output) == {"builds": {"count": 1}, "boots": {"count": 1}}
+
+    for include in ["builds,nope", ","]:
+        result = run("--include", include)
+        assert result.exit_code != 0
+        assert not fetched
+
+
+def test_dashboard_stream_decoder():
+    import json
+
+    from kcidev.libs.dashboard import _iter_json_array
+
+    doc = {"count": 12, "tests": [{"id": i, "path": "a.b"} for i in range(5)] + [1.5]}
+    raw = json.dumps(doc).encode()
+    # feed the decoder one byte at a time
+    chunks = [raw[i : i + 1] for i in range(len(raw))]
+    assert list(_iter_json_array(chunks, "tests", False)) == doc["tests"]
+    assert list(_iter_json_array([raw], "boots", False)) == []
+
+
+def test_gunzip_to_file():
+    import gzip
+    import io
+
+    from kcidev.libs.files import gunzip_to_file
+
+    log = b"kernel log line\n" * 10000
+    data = gzip.compress(log) + gzip.compress(b"second member\n")
+    out = io.BytesIO()
+    gunzip_to_file((data[i : i + 100] for i in range(0, len(data), 100)), out)
+    assert out.getvalue() == log + b"second member\n"
+
+    with pytest.raises(EOFError):
+        gunzip_to_file([data[:50]], io.BytesIO())
+
+
+def test_fetch_log_to_store(tmp_path, monkeypatch):
+    import gzip
+    import hashlib
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from kcidev.libs.files import fetch_log_to_store
+
+    log = b"".join(b"kernel log line %d\n" % i for i in range(100000))
+    data = gzip.compress(log)
+    half = len(data) // 2
+    # requests seen by the stand-in, and whether it honours Range
+    requests_seen = []
+    server_state = {"ranges": True, "delay": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            requests_seen.append((self.path, self.headers.get("Range")))
+            time.sleep(server_state["delay"])
+            body, status = data, 200
+            match = self.headers.get("Range")
+            if match and server_state["ranges"]:
+                offset = int(match[len("bytes=") : -1])
+                if offset >= len(data):
+                    self.send_response(416)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body, status = data[offset:], 206
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    baseurl = f"http://127.0.0.1:{server.server_port}/"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    store = tmp_path / "kci-dev" / "logs"
+
+    def part_file(url, content):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        store.mkdir(parents=True, exist_ok=True)
+        (store / (key + ".gz.part")).write_bytes(content)
+
+    def fetch(url):
+        with open(fetch_log_to_store(url), "rb") as f:
+            assert f.read() == log
+        assert not list(store.glob("*.part"))
+
+    try:
+        # plain download, then served from the store without a request
+        fetch(baseurl + "fresh")
+        fetch(baseurl + "fresh")
+        assert requests_seen == [("/fresh", None)]
+
+        # a partial download is resumed where it stopped
+        requests_seen.clear()
+        part_file(baseurl + "resume", data[:half])
+        fetch(baseurl + "resume")
+        assert requests_seen == [("/resume", f"bytes={half}-")]
+
+        # nothing left to download
+        requests_seen.clear()
+        part_file(baseurl + "complete", data)
+        fetch(baseurl + "complete")
+        assert requests_seen == [("/complete", f"bytes={len(data)}-")]
+
+        # a server ignoring Range sends the whole log again
+        server_state["ranges"] = False
+        part_file(baseurl + "norange", data[:half])
+        fetch(baseurl + "norange")
+
+        # concurrent fetches of the same log download it once
+        requests_seen.clear()
+        server_state["delay"] = 0.2
+        threads = [
+            threading.Thread(target=fetch, args=(baseurl + "shared",)) for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert requests_seen == [("/shared", None)]
+    finally:
+        server.shutdown()
+
+
+def test_link_log_file(tmp_path, monkeypatch):
+    import os
+
+    from kcidev.libs.files import link_log_file
+
+    store_path = tmp_path / "store.log"
+    store_path.write_text("log")
+    log_file = tmp_path / "test.log"
+    log_file.write_text("stale")
+
+    link_log_file(str(store_path), str(log_file))
+    assert os.path.samefile(store_path, log_file)
+    assert not log_file.is_symlink()
+
+    def fail(*args):
+        raise OSError("not supported")
+
+    # no hardlinks across filesystems, fall back to a symlink
+    monkeypatch.setattr(os, "link", fail)
+    link_log_file(str(store_path), str(log_file))
+    assert log_file.is_symlink() and log_file.read_text() == "log"
+
+    # no symlinks either, fall back to a copy
+    monkeypatch.setattr(os, "symlink", fail)
+    link_log_file(str(store_path), str(log_file))
+    assert not log_file.is_symlink() and log_file.read_text() == "log"
+    assert not os.path.samefile(store_path, log_file)
+
+
+def test_download_logs_ordered(monkeypatch):
+    import threading
+    import time
+
+    import kcidev.libs.files as files
+
+    finished = []
+    lock = threading.Lock()
+
+    # later items finish first
+    def download(log_url, log_file):
+        time.sleep(0.05 * (9 - int(log_url)))
+        with lock:
+            finished.append(log_url)
+        return "file://" + log_file
+
+    monkeypatch.setattr(files, "download_logs_to_file", download)
+    items = [str(i) for i in range(10)]
+    results = list(
+        files.download_logs_ordered(items, lambda item: (item, item + ".log"), 4)
+    )
+    assert results == [(item, f"file://{item}.log") for item in items]
+    assert finished != items
+
+
+def test_results_compile_filter():
+    import io
+
+    from kcidev.subcommands.results.parser import (
+        compile_filter,
+        filter_out_by_hardware,
+        filter_out_by_test,
+        iter_tests,
+    )
+
+    filter_data = compile_filter(
+        {
+            "hardware": ["fsl,imx6q", "glob:mediatek,*"],
+            "test": [
+                "baseline.login",
+                "glob:kselftest.*",
+                "re:ltp\\.[a-z]+",
+                "foo[1]",
+                "glob:bar[12]",
+            ],
+        }
+    )
+
+    def result(platform, compatibles, path):
+        return {
+            "environment_misc": {"platform": platform},
+            "environment_compatible": compatibles,
+            "path": path,
+        }
+
+    assert not filter_out_by_hardware(result("imx6q", ["fsl,imx6q"], ""), filter_data)
+    assert not filter_out_by_hardware(result("mediatek,mt8195", [], ""), filter_data)
+    assert filter_out_by_hardware(result("rock2", ["radxa,rock2"], ""), filter_data)
+
+    assert not filter_out_by_test(result("", [], "baseline.login"), filter_data)
+    assert not filter_out_by_test(result("", [], "kselftest.dt.probe"), filter_data)
+    assert not filter_out_by_test(result("", [], "ltp.syscalls"), filter_data)
+    # only entries prefixed with glob: are glob patterns
+    assert not filter_out_by_test(result("", [], "foo[1]"), filter_data)
+    assert filter_out_by_test(result("", [], "foo1"), filter_data)
+    assert not filter_out_by_test(result("", [], "bar1"), filter_data)
+    assert filter_out_by_test(result("", [], "bar[12]"), filter_data)
+    assert filter_out_by_test(result("", [], "kselftest"), filter_data)
+    assert filter_out_by_test(result("", [], "baseline.dmesg"), filter_data)
+
+    # an empty filter file filters nothing
+    tests = [dict(result("rock2", [], "baseline.dmesg"), status="PASS", log_url="u")]
+    selected = iter_tests(tests, "c", False, "all", io.StringIO(""), 1)
+    assert [test for test, _ in selected] == tests
+
+
+def test_maestro_events(monkeypatch):
+    import json
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import kcidev.libs.maestro_common as maestro_common
+    from kcidev.libs.maestro_common import (
+        MaestroClient,
+        maestro_listen,
+        maestro_subscribe,
+        maestro_unsubscribe,
+        maestro_wait_event,
+    )
+
+    # Stand-in for the API events endpoints
+    events = [
+        {"id": "other-node", "treeid": "other-tree", "state": "running"},
+        {"id": "tree-node", "treeid": "tree", "state": "done"},
+    ]
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def reply(self, data):
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path == "/latest/subscribe/node":
+                self.reply({"id": 7, "channel": "node"})
+            else:
+                self.reply({})
+
+        def do_GET(self):
+            assert self.path == "/latest/listen/7"
+            if not events:
+                time.sleep(2)
+                return self.reply({})
+            event = {"specversion": "1.0", "data": events.pop(0)}
+            self.reply({"channel": "node", "data": json.dumps(event)})
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    baseurl = f"http://127.0.0.1:{server.server_port}/"
+    monkeypatch.setattr(maestro_common, "_client", MaestroClient(retries=0))
+    try:
+        sub_id = maestro_subscribe(baseurl, "token")
+        assert sub_id == 7
+        # the event about another tree is skipped
+        assert maestro_wait_event(baseurl, "token", sub_id, "tree", [], {}, 5)
+        assert not events
+        # no event in time
+        assert maestro_listen(baseurl, "token", sub_id, 0.5) == {}
+        maestro_unsubscribe(baseurl, "token", sub_id)
+    finally:
+        server.shutdown()
+        server.server_close()
+    # subscription failure is reported, to fall back to polling
+    assert maestro_subscribe(baseurl, "token") is None
+
+
+def test_maestro_poll_scheduler():
+    from kcidev.libs.maestro_common import PollScheduler
+
+    scheduler = PollScheduler(fast=5, slow=30, max_interval=180, jitter=0.2, warmup=0)
+    assert 24 <= scheduler.next_interval() <= 36
+    for _ in range(3):
+        scheduler.update(False)
+    # 30 * 1.5^3, with jitter
+    assert 0.8 * 101.25 <= scheduler.next_interval() <= 1.2 * 101.25
+    for _ in range(10):
+        scheduler.update(False)
+    assert scheduler.next_interval() <= 1.2 * 180
+    scheduler.update(True, near_completion=True)
+    assert scheduler.next_interval() <= 6
+
+
+def test_maestro_watch_trees_stop(monkeypatch):
+    import threading
+    import time
+
+    import kcidev.libs.maestro_common as maestro_common
+    from kcidev.libs.maestro_common import (
+        MaestroClient,
+        MaestroWatchStopped,
+        maestro_sleep,
+        maestro_watch_trees,
+    )
+
+    stopped = []
+
+    def watch_tree(baseurl, token, treeid, job_filter, test, events, label, stop):
+        if treeid == "broken":
+            time.sleep(0.1)
+            raise RuntimeError("watch failed")
+        try:
+            while True:
+                maestro_sleep(60, stop)
+        except MaestroWatchStopped:
+            stopped.append(treeid)
+            raise
+
+    monkeypatch.setattr(maestro_common, "_client", MaestroClient(retries=0))
+    monkeypatch.setattr(maestro_common, "maestro_watch_tree", watch_tree)
+    start = time.time()
+    # the failure surfaces without waiting for the other watchers
+    with pytest.raises(RuntimeError):
+        maestro_watch_trees("http://api/", "token", ["a", "broken", "b"], [], None)
+    deadline = time.time() + 5
+    while len(stopped) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sorted(stopped) == ["a", "b"]
+    assert time.time() - start < 5
+
+    stop = threading.Event()
+    stop.set()
+    with pytest.raises(MaestroWatchStopped):
+        maestro_sleep(60, stop)
+
+
+def maestro_watch_snapshots(kbuild_result="pass", test_result="pass"):
+    """Snapshots of a tree polled while its checkout, kbuild, job and test run"""
+
+    def node(id, kind, state, result, second):
+        return {
+            "id": id,
+            "treeid": "tree",
+            "kind": kind,
+            "name": kind,
+            "parent": None,
+            "state": state,
+            "result": result,
+            "updated": f"2024-01-01T00:00:{second:02d}",
+        }
+
+    checkout = node("c", "checkout", "available", None, 2)
+    kbuild = node("k", "kbuild", "done", kbuild_result, 4)
+    return [
+        [node("c", "checkout", "running", None, 1)],
+        [checkout, node("k", "kbuild", "running", None, 2)],
+        [checkout, node("k", "kbuild", "running", None, 2)],
+        [checkout, kbuild, node("j", "job", "running", None, 4)],
+        [
+            checkout,
+            kbuild,
+            node("j", "job", "done", "pass", 5),
+            node("t", "test", "done", test_result, 5),
+        ],
+    ]
+
+
+def test_maestro_watch_tree(monkeypatch):
+    import kcidev.libs.maestro_common as maestro_common
+
+    polls = []
+
+    # the API only returns the nodes updated since the cursor
+    def retrieve(baseurl, token, treeid, updated_since=None):
+        snapshot = snapshots[min(len(polls), len(snapshots) - 1)]
+        nodes = [
+            node
+            for node in snapshot
+            if not updated_since or node["updated"] >= updated_since
+        ]
+        polls.append((updated_since, [node["id"] for node in nodes]))
+        return nodes
+
+    monkeypatch.setattr(maestro_common, "maestro_retrieve_treeid_nodes", retrieve)
+    monkeypatch.setattr(maestro_common, "maestro_sleep", lambda *args: None)
+
+    def watch(test, **results):
+        polls.clear()
+        snapshots[:] = maestro_watch_snapshots(**results)
+        return maestro_common.maestro_watch_tree(
+            "http://api/", "token", "tree", ["kbuild", "job"], test
+        )
+
+    snapshots = []
+    assert watch("test", test_result="pass") == 0
+    # after the first poll only the nodes changed since the cursor are fetched
+    assert polls == [
+        (None, ["c"]),
+        ("2024-01-01T00:00:01", ["c", "k"]),
+        ("2024-01-01T00:00:02", ["c", "k"]),
+        ("2024-01-01T00:00:02", ["c", "k", "j"]),
+        ("2024-01-01T00:00:04", ["k", "j", "t"]),
+    ]
+    assert watch("test", test_result="fail") == 1
+    # a job the test depends on failed
+    assert watch("test", kbuild_result="incomplete") == 2
+    assert len(polls) == 4
+    # without a test, done once all the jobs are
+    assert watch(None) is None
+    assert len(polls) == 5
+
+
+def test_maestro_print_nodes(capsys):
+    import json
+
+    from kcidev.libs.maestro_common import maestro_print_nodes
+
+    nodes = [{"id": "1", "name": "a", "data": {"arch": "x86"}}, {"id": "2"}]
+    maestro_print_nodes(iter(nodes), ["id", "data"])
+    expected = [{"id": "1", "data": {"arch": "x86"}}, {"id": "2", "data": None}]
+    assert (
+        capsys.readouterr().out == json.dumps(expected, sort_keys=True, indent=4) + "\n"
+    )
+    maestro_print_nodes(iter(nodes), ["id"], ndjson=True)
+    assert capsys.readouterr().out == '{"id": "1"}\n{"id": "2"}\n'
+    maestro_print_nodes(iter([]), [])
+    assert capsys.readouterr().out == "[]\n"
+
+
+def test_maestro_filter_params():
+    from kcidev.libs.maestro_common import maestro_filter_params
+
+    assert maestro_filter_params(
+        ["kind=test", "result!=pass", "name~^base", "name*=a.b", "updated=2025-01-01.."]
+    ) == [
+        ("kind", "test"),
+        ("result__ne", "pass"),
+        ("name__re", "^base"),
+        ("name__re", "a\\.b"),
+        ("updated__gte", "2025-01-01"),
+    ]
+    assert maestro_filter_params(
+        ["updated>=2025-01-01T00:00:00Z", "created=2025-01-01T00:00:00.1..2025-01-02"]
+    ) == [
+        ("updated__gte", "2025-01-01T00:00:00Z"),
+        ("created__gte", "2025-01-01T00:00:00.1"),
+        ("created__lte", "2025-01-02"),
+    ]
+    assert maestro_filter_params(["created<2025-01-01T10:00:00.1234567+02:00"])
+    for invalid in [
+        "kind=",
+        "updated>=yesterday",
+        "updated>=2025-13-01Z",
+        "name~(",
+        "kind__foo=1",
+    ]:
+        with pytest.raises(ValueError):
+            maestro_filter_params([invalid])
+
+
+def test_maestro_get_subtree(monkeypatch):
+    import errno
+
+    from click.testing import CliRunner
+
+    import kcidev.libs.maestro_common as maestro_common
+    from kcidev.subcommands.maestro_results import maestro_results
+
+    def node(id, parent):
+        return {"id": id, "parent": parent, "treeid": "tree"}
+
+    tree = [node("c", None)]
+    for build in range(20):
+        tree.append(node(f"k{build}", "c"))
+        tree += [node(f"t{build}.{test}", f"k{build}") for test in range(50)]
+    index = {n["id"]: n for n in tree}
+    pages = []
+
+    def get_nodes(url, limit, offset, params):
+        assert params == [("treeid", "tree")]
+        pages.append(offset)
+        return tree[offset : offset + limit]
+
+    monkeypatch.setattr(maestro_common, "maestro_get_node", lambda url, id: index[id])
+    monkeypatch.setattr(maestro_common, "maestro_get_nodes", get_nodes)
+    nodes = maestro_common.maestro_get_subtree("http://api/", "c")
+    assert len(nodes) == 1021
+    assert nodes[0]["id"] == "c" and nodes[1]["id"] == "k0"
+    # the pages of the tree, not one request per node
+    assert len(pages) <= 4
+    nodes = maestro_common.maestro_get_subtree("http://api/", "c", depth=1)
+    assert [n["id"] for n in nodes] == ["c"] + [f"k{build}" for build in range(20)]
+    nodes = maestro_common.maestro_get_subtree("http://api/", "k3")
+    assert [n["id"] for n in nodes] == ["k3"] + [f"t3.{test}" for test in range(50)]
+
+    obj = {"CFG": {"local": {"api": "http://api/"}}, "INSTANCE": "local"}
+    for args in (["--nodeid", "k3"], ["--nodes"], ["--filter", "kind=test"]):
+        result = CliRunner().invoke(maestro_results, ["--subtree", "c"] + args, obj=obj)
+        assert result.exit_code == errno.EINVAL
+
+
+def test_maestro_nest_nodes():
+    from kcidev.libs.maestro_common import maestro_nest_nodes
+
+    nodes = [
+        {"id": "c", "parent": None, "name": "checkout"},
+        {"id": "b", "parent": "c", "name": "kbuild"},
+        {"id": "t", "parent": "b", "name": "test"},
+    ]
+    tree = maestro_nest_nodes(nodes, ["name"])
+    assert tree["name"] == "checkout"
+    assert tree["children"][0]["children"] == [{"name": "test", "children": []}]
+
+
+def test_maestro_node_cache(tmp_path, monkeypatch):
+    import kcidev.libs.maestro_common as maestro_common
+    from kcidev.libs.maestro_common import MaestroClient
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    url = "https://api/latest/node/"
+    client = MaestroClient(node_cache=True)
+    client.cache_node(url + "1", {"id": "1", "state": "running"})
+    client.cache_node(url + "2", {"id": "2", "state": "done", "result": "pass"})
+    assert client.cached_node(url + "1") is None
+    assert client.cached_node(url + "2")["result"] == "pass"
+    # done nodes are kept on disk for the next runs
+    assert MaestroClient(node_cache=True).cached_node(url + "2")["id"] == "2"
+    assert MaestroClient().cached_node(url + "2") is None
+    # a cache directory that can't be written only disables the disk cache
+    client = MaestroClient(node_cache=True)
+    client.node_cache_dir = str(tmp_path / "missing")
+    client.cache_node(url + "3", {"id": "3", "state": "done"})
+    assert client.cached_node(url + "3")["id"] == "3"
+
+    # only the most recently used nodes are kept in memory
+    monkeypatch.setattr(maestro_common, "MAESTRO_NODE_CACHE_SIZE", 2)
+    client = MaestroClient()
+    for nodeid in ["1", "2", "3"]:
+        client.cache_node(url + nodeid, {"id": nodeid, "state": "done"})
+        client.cached_node(url + "1")
+    assert client.cached_node(url + "1") is not None
+    assert client.cached_node(url + "2") is None
+    assert client.cached_node(url + "3") is not None
+
+    # node listings are not cached
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return [{"id": "4", "state": "done"}]
+
+    monkeypatch.setattr(maestro_common, "_client", client)
+    monkeypatch.setattr(client, "get", lambda url: Response())
+    assert maestro_common.maestro_get_nodes("https://api/", 10, 0, [])[0]["id"] == "4"
+    assert client.cached_node(url + "4") is None
+
+
+@pytest.fixture
+def bisect_repo(tmp_path, monkeypatch):
+    """A repository with 10 commits, bisected between the first and last"""
+    repo = git.Repo.init(tmp_path)
+    commits = []
+    for i in range(10):
+        (tmp_path / "file").write_text(f"{i}\n")
+        repo.index.add("file")
+        commits.append(repo.index.commit(f"commit {i}").hexsha)
+    repo.git.bisect("start", commits[-1], commits[0])
+    monkeypatch.chdir(tmp_path)
+    return commits
+
+
+def test_bisect_range(bisect_repo):
+    from kcidev.subcommands.bisect import (
+        bisect_candidates,
+        bisect_mark,
+        bisect_range,
+        speculate_commits,
+    )
+
+    commits = bisect_repo
+    assert bisect_range() == commits[1:9]
+    assert bisect_candidates(3) == [commits[3], commits[5], commits[7]]
+    assert bisect_candidates(20) == commits[1:9]
+    assert speculate_commits(commits[5]) == {"good": commits[7], "bad": commits[3]}
+    assert speculate_commits(commits[9]) == {}
+
+    state = {"history": []}
+    results = {commits[3]: "good", commits[5]: "bad", commits[7]: "bad"}
+    assert bisect_mark(state, results) == commits[4]
+    # results after the first bad one are left out
+    assert state["history"] == [{commits[3]: "good"}, {commits[5]: "bad"}]
+    assert bisect_range() == [commits[4]]
+
+
+def test_bisect_dashboard_commit_result(monkeypatch):
+    import click
+
+    import kcidev.subcommands.bisect as bisect
+
+    def test(path, status, platform="p1"):
+        return {
+            "path": path,
+            "status": status,
+            "environment_misc": {"platform": platform},
+        }
+
+    records = {
+        ("tests", "a"): [test("baseline.login", "PASS"), test("other", "FAIL")],
+        ("tests", "b"): [test("baseline.login", "FAIL"), test("login", "PASS", "p2")],
+        ("boots", "c"): [
+            test("baseline.login", "FAIL"),
+            test("baseline.login", "PASS"),
+        ],
+    }
+    calls = []
+
+    def stream(kind, origin, giturl, branch, commit, arch, use_json, quiet):
+        assert quiet
+        calls.append((kind, commit))
+        if commit == "unknown":
+            raise click.exceptions.Abort()
+        return iter(records.get((kind, commit), []))
+
+    monkeypatch.setattr(bisect, "dashboard_stream_commit_results", stream)
+    state = {"giturl": "url", "branch": "master", "test": "login"}
+    state["platform_filter"] = ["p1"]
+    assert bisect.dashboard_commit_result(state, "a") == "good"
+    # boots are only looked up when the tests have no result
+    assert calls == [("tests", "a")]
+    assert bisect.dashboard_commit_result(state, "b") == "bad"
+    assert bisect.dashboard_commit_result(state, "c") is None
+    assert bisect.dashboard_commit_result(state, "d") is None
+    calls.clear()
+    assert bisect.dashboard_commit_result(state, "unknown") is None
+    assert calls == [("tests", "unknown")]
+    state["platform_filter"] = []
+    assert bisect.dashboard_commit_result(state, "b") is None
+
+
+def maestro_retry_tree(retry_results, retries_done=True):
+    """
+    Snapshots of a tree where job j1 on platform p1 failed test t, and
+    got retried, along with a retry of the same job on another platform
+    """
+
+    def node(id, kind, parent, state="done", result=None, name=None, platform=None):
+        return {
+            "id": id,
+            "treeid": "tree",
+            "kind": kind,
+            "name": name or kind,
+            "parent": parent,
+            "state": state,
+            "result": result,
+            "data": {"platform": platform},
+            "updated": f"2024-01-01T00:00:{len(id):02d}",
+        }
+
+    first = [
+        node("c", "checkout", None, "available"),
+        node("k", "kbuild", "c", result="pass"),
+        node("j1", "job", "k", result="pass", name="job", platform="p1"),
+        node("t1", "test", "j1", result="fail", name="t"),
+        node("j2", "job", "k", result="pass", name="job", platform="p2"),
+        node("t2", "test", "j2", result="pass", name="t"),
+    ]
+    running = first + [
+        node(f"r{i}", "job", "k", "running", name="job", platform="p1")
+        for i in range(len(retry_results))
+    ]
+    running.append(node("other", "job", "k", "running", name="job", platform="p2"))
+    done = first + [node("other", "job", "k", result="pass", name="job", platform="p2")]
+    for i, result in enumerate(retry_results):
+        state = "done" if retries_done or i == 0 else "closing"
+        done.append(node(f"r{i}", "job", "k", state, "pass", "job", "p1"))
+        done.append(node(f"rt{i}", "test", f"r{i}", result=result, name="t"))
+    return [first, running, done]
+
+
+def test_maestro_watch_retries(monkeypatch):
+    import kcidev.libs.maestro_common as maestro_common
+
+    polls = []
+
+    def retrieve(baseurl, token, treeid, updated_since=None):
+        polls.append(updated_since)
+        return snapshots[min(len(polls), len(snapshots)) - 1]
+
+    monkeypatch.setattr(maestro_common, "maestro_retrieve_treeid_nodes", retrieve)
+    monkeypatch.setattr(maestro_common, "maestro_sleep", lambda *args: None)
+    snapshots = maestro_retry_tree(["pass", "fail"])
+    job = snapshots[0][2]
+    known = {node["id"] for node in snapshots[0]}
+    results = maestro_common.maestro_watch_retries(
+        "http://api/", "token", job, "t", 2, known
+    )
+    # the run of the same job on another platform isn't one of the retries
+    assert results == {"j1": "fail", "r0": "pass", "r1": "fail"}
+    assert len(polls) == 3
+
+    # a retry that is still closing isn't done
+    snapshots = maestro_retry_tree(["pass", "fail"], retries_done=False)
+    snapshots.append(maestro_retry_tree(["pass", "fail"])[-1])
+    polls.clear()
+    results = maestro_common.maestro_watch_retries(
+        "http://api/", "token", job, "t", 2, known
+    )
+    assert results == {"j1": "fail", "r0": "pass", "r1": "fail"}
+    assert len(polls) == 4
+
+
+def test_bisect_confirm_result(monkeypatch):
+    import kcidev.libs.maestro_common as maestro_common
+    import kcidev.subcommands.bisect as bisect
+
+    polls = []
+    retried = []
+
+    def retrieve(baseurl, token, treeid, updated_since=None):
+        polls.append(updated_since)
+        return snapshots[min(len(polls), len(snapshots)) - 1]
+
+    def jobretry(baseurl, jobid, token):
+        retried.append(jobid)
+        return {"message": "OK"}
+
+    monkeypatch.setattr(maestro_common, "maestro_retrieve_treeid_nodes", retrieve)
+    monkeypatch.setattr(maestro_common, "maestro_sleep", lambda *args: None)
+    monkeypatch.setattr(bisect, "send_jobretry", jobretry)
+    instance = {"api": "http://api/", "pipeline": "http://pipeline/", "token": "t"}
+    state = {"test": "t", "retry_fail": 2}
+    check = {"commit": "a", "treeid": "tree", "result": "bad"}
+    for retry_results, expected in [
+        (["fail", "pass"], "bad"),
+        (["pass", "pass"], "good"),
+        (["pass"], "skip"),
+    ]:
+        state["retry_fail"] = len(retry_results)
+        snapshots = maestro_retry_tree(retry_results)
+        polls.clear()
+        retried.clear()
+        assert bisect.confirm_result(instance, state, check) == expected
+        # the job of the failed test is retried, not the one that passed
+        assert retried == ["j1"] * len(retry_results)
+
+    # the result stands when the job can't be retried
+    monkeypatch.setattr(bisect, "send_jobretry", lambda *args: None)
+    snapshots = maestro_retry_tree([])
+    assert bisect.confirm_result(instance, state, check) == "bad"
+
+
+def test_bisect_multisection_resume(bisect_repo, tmp_path, monkeypatch):
+    import json
+
+    import kcidev.subcommands.bisect as bisect
+
+    commits = bisect_repo
+    state_file = str(tmp_path / "state.json")
+    triggered = []
+    watched = []
+
+    def checkout(baseurl, token, commit, **kwargs):
+        triggered.append(commit)
+        return {"node": {"treeid": "tree-" + commit}}
+
+    def watch_tree(baseurl, token, treeid, job_filter, test, label, stop):
+        # the treeid is saved before the checkout is watched
+        with open(state_file) as f:
+            candidates = json.load(f)["candidates"]
+        assert treeid in [check["treeid"] for check in candidates.values()]
+        watched.append(treeid)
+        return results.get(treeid)
+
+    monkeypatch.setattr(bisect, "send_checkout_full", checkout)
+    monkeypatch.setattr(bisect, "maestro_watch_tree", watch_tree)
+    instance = {"api": "http://api/", "pipeline": "http://pipeline/", "token": "t"}
+    state = dict(bisect.default_state, workdir=str(tmp_path), history=[])
+    state.update(test="t", giturl="url", branch="master")
+    # an interrupted round: commits[3] was triggered, commits[5] not yet
+    state["candidates"] = {
+        commits[3]: {"treeid": "in-flight", "result": None},
+        commits[5]: {"treeid": None, "result": None},
+        commits[7]: {"treeid": "tree-" + commits[7], "result": "bad"},
+    }
+    bisect.save_state(state, state_file)
+    # Maestro fails to test commits[5] the first time
+    results = {"in-flight": 0}
+    assert bisect.multisection_loop(instance, state, 3, state_file) is None
+    assert triggered == [commits[5]]
+    assert sorted(watched) == sorted(["in-flight", "tree-" + commits[5]])
+    assert state["candidates"][commits[3]] == {"treeid": "in-flight", "result": "good"}
+    assert state["candidates"][commits[5]] == {"treeid": None, "result": None}
+
+    # only the failed commit is tested again
+    results["tree-" + commits[5]] = 1
+    watched.clear()
+    state = bisect.multisection_loop(instance, state, 3, state_file)
+    assert triggered == [commits[5]] * 2
+    assert watched == ["tree-" + commits[5]]
+    assert state["next_commit"] == commits[4]
+    assert state["candidates"] == {}
+
+
+def test_bisect_check_commit(monkeypatch):
+    import kcidev.subcommands.bisect as bisect
+
+    triggered = []
+    watched = []
+
+    def checkout(baseurl, token, **kwargs):
+        triggered.append(kwargs)
+        return response
+
+    def watch_tree(baseurl, token, treeid, job_filter, test, label, stop):
+        watched.append(treeid)
+        return status
+
+    monkeypatch.setattr(bisect, "send_checkout_full", checkout)
+    monkeypatch.setattr(bisect, "maestro_watch_tree", watch_tree)
+    instance = {"api": "http://api/", "pipeline": "http://pipeline/", "token": "t"}
+    state = dict(bisect.default_state, test="t", giturl="url", branch="master")
+    response = {"node": {"treeid": "tree"}}
+    status = 1
+
+    assert bisect.trigger_commit(instance, state, "a") == "tree"
+    assert triggered == [
+        {
+            "giturl": "url",
+            "branch": "master",
+            "commit": "a",
+            "job_filter": [],
+            "platform_filter": [],
+        }
+    ]
+    assert bisect.check_commit(instance, state, "a") == {
+        "commit": "a",
+        "treeid": "tree",
+        "result": "bad",
+    }
+    assert watched == ["tree"]
+
+    # an already triggered checkout is only watched
+    triggered.clear()
+    status = 2
+    check = bisect.check_commit(instance, state, "a", treeid="other")
+    assert check == {"commit": "a", "treeid": "other", "result": "skip"}
+    assert not triggered and watched == ["tree", "other"]
+    # nothing to watch when the checkout isn't to be triggered here
+    check = bisect.check_commit(instance, state, "a", trigger=False)
+    assert check == {"commit": "a", "treeid": None, "result": None}
+    assert not triggered and len(watched) == 2
+
+    # Maestro failed to test the commit
+    status = None
+    assert bisect.check_commit(instance, state, "a")["result"] is None
+
+    # no treeid in the response
+    response = {"node": {}}
+    assert bisect.trigger_commit(instance, state, "a") is None
+    assert bisect.check_commit(instance, state, "a")["result"] is None
+    assert len(watched) == 3
+
+    # failing to trigger is fatal unless the checkout is speculative
+    response = None
+    assert bisect.trigger_commit(instance, state, "a", required=False) is None
+    with pytest.raises(SystemExit):
+        bisect.trigger_commit(instance, state, "a")
+
+
+def test_bisect_loop_speculative(bisect_repo, tmp_path, monkeypatch):
+    import kcidev.subcommands.bisect as bisect
+
+    commits = bisect_repo
+    state_file = str(tmp_path / "state.json")
+    triggered = []
+    watched = []
+    # speculative checkouts failing to trigger
+    failing = set()
+
+    def checkout(baseurl, token, commit, **kwargs):
+        triggered.append(commit)
+        return None if commit in failing else {"node": {"treeid": "tree-" + commit}}
+
+    # commits[6] is the first bad commit
+    def watch_tree(baseurl, token, treeid, job_filter, test, label, stop):
+        watched.append(treeid)
+        return int(commits.index(treeid[len("tree-") :]) >= 6)
+
+    def step(state):
+        triggered.clear()
+        watched.clear()
+        state = bisect.bisection_loop(instance, state, speculative=True)
+        # the state is saved and loaded back on every step
+        bisect.save_state(state, state_file)
+        return bisect.load_state(state_file)
+
+    monkeypatch.setattr(bisect, "send_checkout_full", checkout)
+    monkeypatch.setattr(bisect, "maestro_watch_tree", watch_tree)
+    instance = {"api": "http://api/", "pipeline": "http://pipeline/", "token": "t"}
+    state = dict(bisect.default_state, workdir=str(tmp_path), history=[])
+    state.update(test="t", giturl="url", branch="master")
+    repo = git.Repo(tmp_path)
+    speculate_commits = bisect.speculate_commits
+    state["next_commit"] = repo.head.commit.hexsha
+
+    # the commits that can come next are triggered along with the first one
+    commit = state["next_commit"]
+    next_commits = bisect.speculate_commits(commit)
+    state = step(state)
+    assert triggered == [commit] + list(next_commits.values())
+    assert watched == ["tree-" + commit]
+    result = "bad" if commits.index(commit) >= 6 else "good"
+    commit = next_commits[result]
+    assert state["next_commit"] == commit
+    assert state["speculative"] == {commit: "tree-" + commit}
+
+    # the checkout triggered speculatively is reused, not triggered again,
+    # and a speculative commit out of the range left is not used
+    monkeypatch.setattr(
+        bisect,
+        "speculate_commits",
+        lambda commit: {"good": commits[0], "bad": commits[-1]},
+    )
+    state = step(state)
+    assert triggered == [commits[0], commits[-1]]
+    assert watched == ["tree-" + commit]
+    assert state["next_commit"] == repo.head.commit.hexsha
+    assert state["speculative"] == {}
+
+    # a speculative checkout failing to trigger is not used either
+    monkeypatch.setattr(bisect, "speculate_commits", speculate_commits)
+    repo.git.bisect("reset")
+    repo.git.bisect("start", commits[-1], commits[0])
+    state.update(history=[], next_commit=repo.head.commit.hexsha)
+    commit = state["next_commit"]
+    next_commits = speculate_commits(commit)
+    failing.update(next_commits.values())
+    state = step(state)
+    assert triggered == [commit] + list(next_commits.values())
+    assert watched == ["tree-" + commit]
+    assert state["next_commit"] == repo.head.commit.hexsha
+    assert state["speculative"] == {}